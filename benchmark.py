@@ -0,0 +1,602 @@
+import argparse
+import contextlib
+import io
+import os
+import random
+import re
+import tempfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import psycopg2
+from psycopg2.extras import execute_values
+
+import embeddings
+import main as service
+import scraper
+from cache import response_cache
+from citations import extract_citations, format_citation
+from page_archive import PageArchive
+from vector_index import NumpyVectorIndex, write_snapshot
+
+# Benchmarks write into their own schema so legal_records is never touched
+BENCH_SCHEMA = "legal_bench"
+
+
+def sample_rows(count, text_size=2000):
+    """Build synthetic section rows roughly the size of real RCW sections."""
+    body = ("The court shall have jurisdiction over the matter. " * (text_size // 50 + 1))[:text_size]
+    return [
+        ("Title 1", "Chapter 1.04", f"1.04.{i:06d}", body, f"https://app.leg.wa.gov/RCW/default.aspx?cite=1.04.{i:06d}")
+        for i in range(count)
+    ]
+
+
+# Questions and the citations the parser must extract from them, in order
+CITATION_CORPUS = [
+    ("What does RCW 1.04.010 say?", ["RCW 1.04.010"]),
+    ("rcw 2.04.010", ["RCW 2.04.010"]),
+    ("Title 1, Chapter 1.04, Section 1.04.010", ["RCW 1.04.010"]),
+    ("Show me chapter 2.04 RCW", ["chapter 2.04 RCW"]),
+    ("What is in RCW 2.04?", ["chapter 2.04 RCW"]),
+    ("Summarize ch. 43.21C", ["chapter 43.21C RCW"]),
+    ("Compare chapters 2.04 and 2.06", ["chapter 2.04 RCW", "chapter 2.06 RCW"]),
+    ("chapters 2.04, 2.06, and 43.21C RCW", ["chapter 2.04 RCW", "chapter 2.06 RCW", "chapter 43.21C RCW"]),
+    ("chapters 2.04 and 2.06.010", ["chapter 2.04 RCW", "RCW 2.06.010"]),
+    ("What does Title 28A cover?", ["Title 28A RCW"]),
+    ("Compare RCW 28A.150.010 vs 9A.04.010", ["RCW 28A.150.010", "RCW 9A.04.010"]),
+    ("RCW 2.04.010–.030 and 2.04.050", ["RCW 2.04.010-.030", "RCW 2.04.050"]),
+    ("sections 2.04.030 through 2.04.010", ["RCW 2.04.010-.030"]),
+    ("1.04.010 to 2.06.020", ["RCW 1.04.010", "RCW 2.06.020"]),
+    ("See RCW 1.04.010 and again RCW 1.04.010", ["RCW 1.04.010"]),
+    ("Can I appeal within 3 days?", []),
+    ("Is a 1.5 percent fee allowed after 30 days?", []),
+    ("What happens if my landlord keeps my deposit?", []),
+    ("Version 3.2 of the form", []),
+]
+
+
+def bench_citations(args):
+    """Check the parser against CITATION_CORPUS and time it per question."""
+    failures = 0
+    for question, expected in CITATION_CORPUS:
+        found = [format_citation(citation) for citation in extract_citations(question)]
+        if found != expected:
+            failures += 1
+            print(f"❌ {question!r}: expected {expected}, got {found}")
+    print(f"Corpus: {len(CITATION_CORPUS) - failures}/{len(CITATION_CORPUS)} questions parsed correctly")
+
+    questions = [question for question, _ in CITATION_CORPUS]
+    start = time.perf_counter()
+    for _ in range(args.iterations):
+        for question in questions:
+            extract_citations(question)
+    elapsed = time.perf_counter() - start
+    calls = args.iterations * len(questions)
+    print(f"extract_citations: {elapsed / calls * 1e6:.2f}µs/question ({calls / elapsed:,.0f} questions/sec)")
+
+
+# Saved pages named by citation: "2.html" (title), "2.04.html" (chapter),
+# "2.04.010.html" (section). Fetched once by --download.
+FIXTURE_CITES = ["2", "2.04", "2.04.010", "2.04.020", "2.04.031", "2.04.071", "2.04.150", "2.04.190"]
+
+
+def download_fixtures(directory):
+    os.makedirs(directory, exist_ok=True)
+    for cite in FIXTURE_CITES:
+        content = scraper.fetch_page(f"https://app.leg.wa.gov/RCW/default.aspx?cite={cite}")
+        if content is not None:
+            with open(os.path.join(directory, f"{cite}.html"), "wb") as f:
+                f.write(content)
+
+
+def load_fixtures(directory):
+    """Return (kind, cite, raw bytes) for every saved page in directory."""
+    pages = []
+    for name in sorted(os.listdir(directory)):
+        cite, ext = os.path.splitext(name)
+        if ext == ".html":
+            with open(os.path.join(directory, name), "rb") as f:
+                pages.append((cite, f.read()))
+    return classify_fixtures(pages)
+
+
+def archive_fixtures(directory, limit=None):
+    """Like load_fixtures, but read pages from a scraper page archive."""
+    archive = PageArchive(directory)
+    try:
+        urls = [url for url in archive.urls() if "cite=" in url.lower()][:limit]
+        return classify_fixtures((url.lower().rpartition("cite=")[2].upper(), archive.get(url)) for url in urls)
+    finally:
+        archive.close()
+
+
+def classify_fixtures(pages):
+    kinds = {0: "title", 1: "chapter", 2: "section"}
+    return [(kinds[cite.count(".")], cite, content) for cite, content in pages if cite.count(".") in kinds]
+
+
+def parse_fixture(kind, cite, content):
+    url = f"https://app.leg.wa.gov/RCW/default.aspx?cite={cite}"
+    if kind == "title":
+        return scraper.parse_chapter_links(content, cite)
+    if kind == "chapter":
+        return scraper.parse_section_links(content, url)
+    return scraper.parse_section_content(content, url)
+
+
+def bench_parser(args):
+    """Time each parser configuration over saved pages and check they agree."""
+    if args.archive:
+        fixtures = archive_fixtures(args.archive, args.limit)
+    else:
+        if args.download:
+            download_fixtures(args.fixtures)
+        fixtures = load_fixtures(args.fixtures) if os.path.isdir(args.fixtures) else []
+    if not fixtures:
+        print(f"No fixtures in {args.archive or args.fixtures}; run with --download first")
+        return
+
+    configs = [("html.parser", False), ("html.parser", True)]
+    if scraper.HTML_PARSER == "lxml":
+        configs += [("lxml", False), ("lxml", True)]
+    original = scraper.HTML_PARSER, scraper.STRAIN_HTML
+    total_bytes = sum(len(content) for _, _, content in fixtures)
+    baseline = None
+    try:
+        for parser, strain in configs:
+            scraper.HTML_PARSER, scraper.STRAIN_HTML = parser, strain
+            with contextlib.redirect_stdout(io.StringIO()):
+                results = [parse_fixture(*fixture) for fixture in fixtures]
+                start = time.perf_counter()
+                for _ in range(args.iterations):
+                    for fixture in fixtures:
+                        parse_fixture(*fixture)
+                elapsed = time.perf_counter() - start
+
+            pages = args.iterations * len(fixtures)
+            name = f"{parser}{' + strainer' if strain else ''}"
+            print(f"{name:<28} {pages / elapsed:8.1f} pages/sec  {elapsed / pages * 1000:7.2f}ms/page  "
+                  f"{total_bytes * args.iterations / elapsed / 1e6:6.1f} MB/sec")
+            if baseline is None:
+                baseline = results
+            for (kind, cite, _), expected, found in zip(fixtures, baseline, results):
+                if found != expected:
+                    print(f"❌ {name} disagrees with html.parser on {kind} {cite}")
+    finally:
+        scraper.HTML_PARSER, scraper.STRAIN_HTML = original
+
+
+# Modules whose DB_CONFIG is redirected to the scratch schema
+BENCH_MODULES = (scraper, embeddings, service)
+
+
+@contextlib.contextmanager
+def bench_schema():
+    """Point each module's DB_CONFIG at a scratch schema and drop it afterwards."""
+    original = scraper.DB_CONFIG
+    conn = psycopg2.connect(**original)
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+        cursor.execute(f"CREATE SCHEMA {BENCH_SCHEMA}")
+    for module in BENCH_MODULES:
+        # public stays on the path so the pgvector types resolve
+        module.DB_CONFIG = {**original, "options": f"-c search_path={BENCH_SCHEMA},public"}
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            scraper.create_db()
+        yield
+    finally:
+        for module in BENCH_MODULES:
+            module.DB_CONFIG = original
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+        conn.close()
+
+
+def truncate_records():
+    """Empty legal_records (and its chunks) in the scratch schema."""
+    conn = psycopg2.connect(**scraper.DB_CONFIG)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("TRUNCATE legal_records RESTART IDENTITY CASCADE")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def report(name, rows, elapsed):
+    print(f"{name:<28} {rows:>8} rows  {elapsed:8.2f}s  {rows / elapsed:10.1f} rows/sec")
+
+
+def report_latency(name, seconds, elapsed=None):
+    """Print latency percentiles; throughput is over `elapsed` wall time when requests overlapped."""
+    ms = np.array(seconds) * 1000
+    print(f"{name:<28} p50 {np.percentile(ms, 50):8.2f}ms  p95 {np.percentile(ms, 95):8.2f}ms  "
+          f"p99 {np.percentile(ms, 99):8.2f}ms  ({len(ms) / (elapsed or sum(seconds) or 1e-9):.1f} queries/sec)")
+
+
+def unit_vectors(rng, count, dim):
+    vectors = rng.standard_normal((count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def bench_db_writes(args):
+    """Compare per-row save_to_db against the batched SectionWriter."""
+    rows = sample_rows(args.rows)
+    with bench_schema():
+        # Silence the per-row confirmations so both paths pay the same I/O
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            for row in rows:
+                scraper.save_to_db(*row)
+            per_row = time.perf_counter() - start
+
+            # Start the batched leg from an empty table too; otherwise every
+            # row is an unchanged-section conflict the upsert skips
+            truncate_records()
+            start = time.perf_counter()
+            with scraper.SectionWriter(flush_size=args.flush_size) as writer:
+                for row in rows:
+                    writer.add(*row)
+            batched = time.perf_counter() - start
+
+    report("save_to_db (per row)", len(rows), per_row)
+    report(f"SectionWriter (batch {args.flush_size})", len(rows), batched)
+    print(f"Speedup: {per_row / batched:.1f}x")
+
+
+def bench_embeddings(args):
+    """Run the embedding pipeline over synthetic rows with the local embedder."""
+    rows = sample_rows(args.rows)
+    with bench_schema():
+        with contextlib.redirect_stdout(io.StringIO()):
+            with scraper.SectionWriter() as writer:
+                for row in rows:
+                    writer.add(*row)
+        stats = embeddings.update_embeddings(
+            embed_fn=embeddings.local_embeddings,
+            batch_size=args.batch_size,
+            concurrency=args.concurrency,
+        )
+    print(f"{stats['chunks'] / max(stats['sections'], 1):.1f} chunks/section, "
+          f"{stats['tokens'] / max(stats['chunks'], 1):.0f} tokens/chunk over {stats['batches']} batches")
+
+
+def bench_vector_search(args):
+    """Latency of the NumPy index, and optionally pgvector's recall@k against it."""
+    rng = np.random.default_rng(0)
+    corpus = unit_vectors(rng, args.size, args.dim)
+    # Queries are noisy copies of corpus vectors, like paraphrased questions
+    queries = corpus[rng.integers(0, args.size, args.queries)] + 0.05 * unit_vectors(rng, args.queries, args.dim)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "bench_index")
+        ids = np.stack([np.arange(args.size), np.arange(args.size)], axis=1).astype(np.int64)
+        write_snapshot(path, ids, corpus)
+        index = NumpyVectorIndex(path).load()
+
+        exact, latencies = [], []
+        for query in queries:
+            start = time.perf_counter()
+            exact.append([record_id for record_id, _ in index.search(query, args.k)])
+            latencies.append(time.perf_counter() - start)
+        report_latency(f"numpy ({args.size} vectors)", latencies)
+
+    if not args.pgvector:
+        return
+
+    with bench_schema():
+        with contextlib.redirect_stdout(io.StringIO()):
+            with scraper.SectionWriter() as writer:
+                for row in sample_rows(args.size, text_size=200):
+                    writer.add(*row)
+        conn = psycopg2.connect(**scraper.DB_CONFIG)
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT id FROM legal_records ORDER BY section")
+            record_ids = [row[0] for row in cursor.fetchall()]
+            execute_values(cursor, """
+                INSERT INTO legal_chunks (record_id, chunk_index, chunk_text, token_count, source_hash, embedding)
+                VALUES %s
+            """, [(record_id, 0, "", 0, "", str(vector.tolist())) for record_id, vector in zip(record_ids, corpus)],
+                template="(%s, %s, %s, %s, %s, %s::vector)")
+        conn.commit()
+        conn.close()
+
+        hits, latencies = 0, []
+        for query, truth in zip(queries, exact):
+            start = time.perf_counter()
+            rows = service.pgvector_search(query.tolist(), args.k)
+            latencies.append(time.perf_counter() - start)
+            hits += len({row[0] for row in rows} & {record_ids[i] for i in truth})
+        report_latency(f"pgvector ({args.size} vectors)", latencies)
+        print(f"pgvector recall@{args.k}: {hits / (len(queries) * args.k):.3f}")
+
+
+# Synthetic sections are written around a topic (subject, action, place).
+# Keyword and semantic questions name a topic, and any section with that
+# topic is a correct answer, so recall stays meaningful when topics repeat.
+LOAD_SUBJECTS = [
+    "landlord", "tenant", "vehicle", "firearm", "contractor", "pharmacy", "school", "employer", "dog",
+    "boat", "well", "ambulance", "pawnbroker", "notary", "cemetery", "dam", "elevator", "casino",
+    "timber", "oyster", "apiary", "livestock", "billboard", "drone", "trailer", "daycare", "tattoo",
+    "locksmith", "vineyard", "marina", "quarry", "pipeline", "railroad", "taxicab", "nursery", "hospital",
+]
+LOAD_ACTIONS = [
+    "registration", "inspection", "licensing", "permit", "appeal", "penalty", "bond", "insurance",
+    "disclosure", "eviction", "impoundment", "certification", "recordkeeping", "renewal", "forfeiture",
+    "audit", "zoning", "assessment", "quarantine", "notice", "exemption", "reporting", "training",
+]
+LOAD_PLACES = [
+    "county", "city", "port district", "irrigation district", "school district", "fire district",
+    "tribal reservation", "state park", "shoreline", "wetland", "highway", "airport", "forest",
+    "public utility district", "transit authority", "library district", "hospital district", "harbor",
+]
+LOAD_FILLER = [
+    "The department shall adopt rules necessary to implement this section.",
+    "A violation of this section is a misdemeanor.",
+    "Fees collected under this section must be deposited into the general fund.",
+    "Nothing in this section limits the authority of the attorney general.",
+    "The director may delegate any power or duty under this section.",
+    "Records kept under this section are subject to public inspection.",
+    "This section expires unless reauthorized by the legislature.",
+    "Notice under this section must be given in writing at least thirty days in advance.",
+]
+LOAD_SECTIONS_PER_CHAPTER = 40
+LOAD_CHAPTERS_PER_TITLE = 50
+
+# Question templates by kind; {section} for citations, the topic otherwise
+LOAD_QUESTIONS = {
+    "citation": ["What does RCW {section} say?", "rcw {section}", "Explain section {section}",
+                 "Show me RCW {section}"],
+    "keyword": ["{subject} {action} {place}", "{place} {subject} {action}"],
+    "semantic": ["What are the rules for {subject} {action} in a {place}?",
+                 "Can a {place} require {action} for my {subject}?",
+                 "What happens if I skip the {action} for a {subject} in the {place}?"],
+}
+
+
+def synthetic_sections(count, rng):
+    """Yield (row, topic) for `count` sections numbered like the RCW."""
+    per_title = LOAD_SECTIONS_PER_CHAPTER * LOAD_CHAPTERS_PER_TITLE
+    for i in range(count):
+        title, rest = divmod(i, per_title)
+        chapter, section = divmod(rest, LOAD_SECTIONS_PER_CHAPTER)
+        chapter_num = f"{title + 1}.{(chapter + 1) * 2:02d}"
+        section_num = f"{chapter_num}.{(section + 1) * 10:03d}"
+        subject, action, place = rng.choice(LOAD_SUBJECTS), rng.choice(LOAD_ACTIONS), rng.choice(LOAD_PLACES)
+        caption = f"{subject.capitalize()} {action}—{place.capitalize()}"
+        text = (f"RCW **{section_num}**\n{caption}\n"
+                f"Any {subject} {action} within a {place} must comply with this section. "
+                f"The {place} may adopt rules for {subject} {action}, and a {subject} that fails the "
+                f"{action} is subject to a civil penalty. " + " ".join(rng.sample(LOAD_FILLER, 2)))
+        link = f"https://app.leg.wa.gov/RCW/default.aspx?cite={section_num}"
+        yield (f"Title {title + 1}", f"Chapter {chapter_num}", section_num, text, link), (subject, action, place)
+
+
+def archived_sections(directory, limit=None):
+    """Yield (row, topic) for the section pages in a scraper page archive.
+
+    The topic is the section's caption, so its questions have one answer.
+    """
+    seen = set()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for kind, cite, content in archive_fixtures(directory, limit):
+            if kind != "section" or cite in seen:
+                continue
+            seen.add(cite)
+            url = f"https://app.leg.wa.gov/RCW/default.aspx?cite={cite}"
+            text = scraper.parse_section_content(content, url)["text"]
+            title, chapter, _ = scraper.parse_section_number(cite)
+            yield (f"Title {title}", f"Chapter {chapter}", cite, text, url), (text.split("\n")[1],)
+
+
+def load_question(kind, row, topic, rng):
+    """A question of `kind` whose answer is this section (or any section with its topic)."""
+    template = rng.choice(LOAD_QUESTIONS[kind])
+    if kind == "citation":
+        return template.format(section=row[2])
+    if len(topic) == 3:
+        return template.format(subject=topic[0], action=topic[1], place=topic[2])
+    caption = topic[0]
+    return caption if kind == "keyword" else f"What does the law say about {caption.lower()}?"
+
+
+def hashed_embeddings(texts, dim=embeddings.EMBEDDING_DIM):
+    """Deterministic bag-of-words embedder with the generate_embeddings contract.
+
+    Words of four or more letters are hashed into signed buckets, so texts
+    that share words get similar vectors and semantic search has something
+    to find, unlike local_embeddings.
+    """
+    vectors = []
+    tokens = 0
+    for text in texts:
+        words = [word for word in re.findall(r"[a-z]+", text.lower()) if len(word) >= 4]
+        vector = np.zeros(dim, dtype=np.float32)
+        for word in words:
+            bucket = zlib.crc32(word.encode("utf-8"))
+            vector[bucket % dim] += 1.0 if bucket & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        vectors.append(vector / norm if norm else vector)
+        tokens += len(words)
+    return vectors, tokens
+
+
+def load_corpus(sections, backend, index_path, batch_size=1000):
+    """Write sections to legal_records and one embedded chunk each to the search backend."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        with scraper.SectionWriter(flush_size=batch_size) as writer:
+            for row in sections:
+                writer.add(*row)
+
+    conn = psycopg2.connect(**scraper.DB_CONFIG)
+    ids, vectors = [], []
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT id, legal_text FROM legal_records ORDER BY id")
+        records = cursor.fetchall()
+        for i in range(0, len(records), batch_size):
+            batch = records[i:i + batch_size]
+            batch_vectors, _ = hashed_embeddings([text for _, text in batch])
+            if backend == "numpy":
+                ids += [(record_id, record_id) for record_id, _ in batch]
+                vectors += batch_vectors
+                continue
+            execute_values(cursor, """
+                INSERT INTO legal_chunks (record_id, chunk_index, chunk_text, token_count, source_hash, embedding)
+                VALUES %s
+            """, [(record_id, 0, text, 0, "", str(vector.tolist()))
+                  for (record_id, text), vector in zip(batch, batch_vectors)],
+                template="(%s, %s, %s, %s, %s, %s::vector)")
+            conn.commit()
+    conn.close()
+    if backend == "numpy":
+        write_snapshot(index_path, np.array(ids, dtype=np.int64).reshape(-1, 2), np.array(vectors, dtype=np.float32))
+
+
+def parse_mix(spec):
+    """Parse "citation=30,keyword=40,semantic=30" into {kind: weight}."""
+    mix = {}
+    for part in spec.split(","):
+        kind, _, weight = part.partition("=")
+        if kind.strip() not in LOAD_QUESTIONS:
+            raise argparse.ArgumentTypeError(f"unknown question kind {kind!r}")
+        mix[kind.strip()] = float(weight)
+    return mix
+
+
+def bench_load(args):
+    """Drive /query at fixed concurrency over a loaded corpus; report latency, throughput and recall@k."""
+    rng = random.Random(args.seed)
+    if args.archive:
+        sections = list(archived_sections(args.archive, args.limit))
+    else:
+        sections = list(synthetic_sections(args.sections, rng))
+    if not sections:
+        print(f"No section pages in {args.archive}")
+        return
+    answers = {}
+    for row, topic in sections:
+        answers.setdefault(topic, set()).add(row[2])
+
+    kinds = rng.choices(list(args.mix), weights=list(args.mix.values()), k=args.queries)
+    questions = []
+    for kind in kinds:
+        row, topic = rng.choice(sections)
+        expected = {row[2]} if kind == "citation" else answers[topic]
+        questions.append((kind, load_question(kind, row, topic, rng), expected))
+
+    original = (service.get_embedding, service.SEARCH_BACKEND, service.vector_index, service.query_response_cache)
+    with bench_schema(), tempfile.TemporaryDirectory() as tmp_dir:
+        start = time.perf_counter()
+        index_path = os.path.join(tmp_dir, "bench_index")
+        load_corpus([row for row, _ in sections], args.backend, index_path)
+        print(f"Loaded {len(sections)} sections into {args.backend} in {time.perf_counter() - start:.1f}s")
+
+        service.get_embedding = lambda text: hashed_embeddings([text])[0][0].tolist()
+        service.SEARCH_BACKEND = args.backend
+        service.vector_index = NumpyVectorIndex(index_path).load()
+        # Every question should reach the database unless caching is under test
+        service.query_response_cache = original[3] if args.cache else response_cache(max_size=0)
+        service.corpus_version["version"] = None
+        try:
+            from fastapi.testclient import TestClient
+
+            with TestClient(service.app) as client:
+                def ask(question):
+                    start = time.perf_counter()
+                    response = client.get("/query", params={"question": question, "top_k": args.k, "timings": "true"})
+                    return time.perf_counter() - start, response.json()
+
+                with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        list(pool.map(ask, [question for _, question, _ in questions[:args.concurrency * 2]]))
+                        start = time.perf_counter()
+                        results = list(pool.map(ask, [question for _, question, _ in questions]))
+                        elapsed = time.perf_counter() - start
+        finally:
+            service.get_embedding, service.SEARCH_BACKEND, service.vector_index, service.query_response_cache = original
+
+    print(f"{len(questions)} questions at concurrency {args.concurrency}: "
+          f"{len(questions) / elapsed:.1f} queries/sec over {elapsed:.1f}s")
+    stages = {}
+    for kind in args.mix:
+        latencies, hits, errors = [], 0, 0
+        for (question_kind, _, expected), (seconds, response) in zip(questions, results):
+            if question_kind != kind:
+                continue
+            latencies.append(seconds)
+            if "error" in response:
+                errors += 1
+                continue
+            laws = (response.get("relevant_laws") or [response["relevant_law"]]) if "method" in response else []
+            hits += any(law["Section"] in expected for law in laws[:args.k])
+            for stage, ms in response.get("timings", {}).items():
+                stages.setdefault(stage, []).append(ms)
+        if latencies:
+            report_latency(kind, latencies, elapsed)
+            print(f"{'':<28} recall@{args.k} {hits / len(latencies):.3f}" + (f"  ({errors} errors)" if errors else ""))
+    print("Mean stage time per question: " + ", ".join(
+        f"{stage} {sum(ms) / len(results):.2f}ms" for stage, ms in sorted(stages.items(), key=lambda item: item[0] == "total")
+    ))
+    report_latency("all", [seconds for seconds, _ in results], elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the RCW crawler and query service.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    db_writes = subparsers.add_parser("db-writes", help="rows/sec of save_to_db vs SectionWriter")
+    db_writes.add_argument("--rows", type=int, default=2000)
+    db_writes.add_argument("--flush-size", type=int, default=scraper.DB_FLUSH_SIZE)
+    db_writes.set_defaults(func=bench_db_writes)
+
+    embed = subparsers.add_parser("embeddings", help="embedding pipeline throughput with a local embedder")
+    embed.add_argument("--rows", type=int, default=5000)
+    embed.add_argument("--batch-size", type=int, default=embeddings.EMBED_BATCH_SIZE)
+    embed.add_argument("--concurrency", type=int, default=embeddings.EMBED_CONCURRENCY)
+    embed.set_defaults(func=bench_embeddings)
+
+    vector = subparsers.add_parser("vector-search", help="NumPy index latency and pgvector recall@k")
+    vector.add_argument("--size", type=int, default=50000)
+    vector.add_argument("--dim", type=int, default=embeddings.EMBEDDING_DIM)
+    vector.add_argument("--queries", type=int, default=200)
+    vector.add_argument("-k", type=int, default=5)
+    vector.add_argument("--pgvector", action="store_true", help="also measure pgvector against exact results")
+    vector.set_defaults(func=bench_vector_search)
+
+    cites = subparsers.add_parser("citations", help="citation parser accuracy on the corpus and µs/question")
+    cites.add_argument("--iterations", type=int, default=2000)
+    cites.set_defaults(func=bench_citations)
+
+    parse = subparsers.add_parser("parser", help="page parsing throughput over saved RCW HTML fixtures")
+    parse.add_argument("--fixtures", default="fixtures", help="directory of <cite>.html pages")
+    parse.add_argument("--download", action="store_true", help="fetch FIXTURE_CITES into --fixtures first")
+    parse.add_argument("--archive", metavar="DIR", help="read pages from a scraper page archive instead")
+    parse.add_argument("--limit", type=int, help="at most this many archived pages")
+    parse.add_argument("--iterations", type=int, default=20)
+    parse.set_defaults(func=bench_parser)
+
+    load = subparsers.add_parser("load", help="/query latency, throughput and recall@k over a loaded corpus")
+    load.add_argument("--sections", type=int, default=10000, help="synthetic sections to load")
+    load.add_argument("--archive", metavar="DIR", help="load the section pages of a scraper page archive instead")
+    load.add_argument("--limit", type=int, help="at most this many archived pages")
+    load.add_argument("--backend", choices=sorted(service.SEARCH_BACKENDS), default="pgvector")
+    load.add_argument("--queries", type=int, default=1000)
+    load.add_argument("--concurrency", type=int, default=8)
+    load.add_argument("--mix", type=parse_mix, default=parse_mix("citation=30,keyword=40,semantic=30"),
+                      help="question kinds and weights")
+    load.add_argument("-k", type=int, default=5)
+    load.add_argument("--cache", action="store_true", help="keep the API response cache on")
+    load.add_argument("--seed", type=int, default=0)
+    load.set_defaults(func=bench_load)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
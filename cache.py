@@ -0,0 +1,196 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+
+def normalize_question(text):
+    """Cache key for a question: case- and whitespace-insensitive."""
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+class LRUCache:
+    """Thread-safe in-memory LRU cache with an optional time-to-live."""
+
+    def __init__(self, max_size=1024, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, stored_at = entry
+                if self.ttl is None or time.monotonic() - stored_at < self.ttl:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+                self.evictions += 1
+            self.misses += 1
+            return None
+
+    def set(self, key, value, age=0.0):
+        """Store value as if it was stored `age` seconds ago (for the TTL)."""
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() - age)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class SQLiteCache:
+    """Persistent cache tier in a local SQLite file, bounded by size and TTL."""
+
+    def __init__(self, path, max_size=100000, ttl=None, dumps=json.dumps, loads=json.loads):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.dumps = dumps
+        self.loads = loads
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                stored_at REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS cache_stored_at ON cache (stored_at)")
+        self.conn.commit()
+
+    def get(self, key):
+        entry = self.get_entry(key)
+        return entry[0] if entry is not None else None
+
+    def get_entry(self, key):
+        """(value, seconds since it was stored) for a live entry, else None."""
+        with self.lock:
+            row = self.conn.execute("SELECT value, stored_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                age = max(0.0, time.time() - row[1])
+                if self.ttl is None or age < self.ttl:
+                    self.hits += 1
+                    return self.loads(row[0]), age
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, stored_at) VALUES (?, ?, ?)",
+                (key, self.dumps(value), time.time())
+            )
+            if self.ttl is not None:
+                self.conn.execute("DELETE FROM cache WHERE stored_at < ?", (time.time() - self.ttl,))
+            # Trim the oldest entries beyond max_size
+            self.conn.execute("""
+                DELETE FROM cache WHERE key IN (
+                    SELECT key FROM cache ORDER BY stored_at DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_size,))
+            self.conn.commit()
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM cache")
+            self.conn.commit()
+
+    def stats(self):
+        with self.lock:
+            size = self.conn.execute("SELECT count(*) FROM cache").fetchone()[0]
+            return {"size": size, "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+
+class TieredCache:
+    """In-memory LRU in front of an optional persistent tier."""
+
+    def __init__(self, memory, persistent=None):
+        self.memory = memory
+        self.persistent = persistent
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is None and self.persistent is not None:
+            entry = self.persistent.get_entry(key)
+            if entry is not None:
+                # Promote with the entry's age so its TTL is not restarted
+                value, age = entry
+                self.memory.set(key, value, age=age)
+        return value
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.persistent is not None:
+            self.persistent.set(key, value)
+
+    def clear(self):
+        self.memory.clear()
+        if self.persistent is not None:
+            self.persistent.clear()
+
+    def stats(self):
+        stats = {"memory": self.memory.stats()}
+        if self.persistent is not None:
+            stats["persistent"] = self.persistent.stats()
+        return stats
+
+
+def bump_corpus_version(cursor):
+    """Record that legal_records changed; cached responses keyed on older versions go stale."""
+    cursor.execute("UPDATE corpus_version SET version = version + 1, updated_at = now()")
+
+
+def read_corpus_version(cursor):
+    cursor.execute("SELECT version FROM corpus_version")
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def pack_floats(values):
+    """Store an embedding as float32 bytes (4 bytes per dimension)."""
+    return array("f", values).tobytes()
+
+
+def unpack_floats(data):
+    return array("f", bytes(data)).tolist()
+
+
+def embedding_cache(max_size=1024, ttl=None, path=None):
+    """Cache for question embeddings, persisted to SQLite when a path is given."""
+    persistent = SQLiteCache(path, ttl=ttl, dumps=pack_floats, loads=unpack_floats) if path else None
+    return TieredCache(LRUCache(max_size, ttl), persistent)
+
+
+def response_cache(max_size=4096, ttl=None, path=None):
+    """Cache for JSON API responses; a SQLite path shares it between worker processes."""
+    persistent = SQLiteCache(path, ttl=ttl) if path else None
+    return TieredCache(LRUCache(max_size, ttl), persistent)
@@ -0,0 +1,98 @@
+import re
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except ImportError:
+    _ENCODING = None
+
+# Chunk budget in model tokens, and how much of the previous chunk each new
+# chunk repeats so a sentence cut at a boundary is still searchable
+CHUNK_MAX_TOKENS = 512
+CHUNK_OVERLAP_TOKENS = 64
+
+# Subsection markers as they appear in RCW text: (1), (a), (iv), (A)
+SUBSECTION_PATTERN = re.compile(r"(?:^|(?<=\s))(?=\((?:\d+|[a-z]|[ivxlc]+|[A-Z])\)\s)")
+
+# Fallback estimate: one token per word or punctuation mark
+TOKEN_ESTIMATE_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def count_tokens(text):
+    """Count model tokens, or estimate them when tiktoken is not installed."""
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    return len(TOKEN_ESTIMATE_PATTERN.findall(text))
+
+
+def split_subsections(text):
+    """Split section text before each subsection marker."""
+    return [part.strip() for part in SUBSECTION_PATTERN.split(text) if part.strip()]
+
+
+def tail_text(text, max_tokens):
+    """Return the trailing words of text that fit in max_tokens."""
+    words = text.split()
+    count = min(len(words), max_tokens)
+    while count > 0:
+        tail = " ".join(words[-count:])
+        if count_tokens(tail) <= max_tokens:
+            return tail
+        count = int(count * 0.8)
+    return ""
+
+
+def split_words(text, max_tokens):
+    """Split an oversized subsection into word windows of at most max_tokens."""
+    pieces = []
+    current = []
+    current_tokens = 0
+    for word in text.split():
+        word_tokens = count_tokens(" " + word)
+        if current and current_tokens + word_tokens > max_tokens:
+            pieces.append(" ".join(current))
+            current = []
+            current_tokens = 0
+        current.append(word)
+        current_tokens += word_tokens
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+
+def chunk_text(text, max_tokens=CHUNK_MAX_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """Split section text into token-bounded chunks on subsection boundaries.
+
+    Whole subsections are packed greedily; a subsection larger than the
+    budget is split on words. Each chunk after the first starts with up to
+    `overlap_tokens` from the end of the previous one. Token counts of
+    joined pieces are summed, which matches the tokenizer to within a few
+    tokens at the joins.
+    """
+    # Oversized subsections leave room for the overlap carried into them
+    window_tokens = max(max_tokens - overlap_tokens, 1)
+    pieces = []
+    for subsection in split_subsections(text):
+        if count_tokens(subsection) <= max_tokens:
+            pieces.append(subsection)
+        else:
+            pieces.extend(split_words(subsection, window_tokens))
+
+    chunks = []
+    current = ""
+    current_tokens = 0
+    for piece in pieces:
+        piece_tokens = count_tokens(piece)
+        if current and current_tokens + piece_tokens > max_tokens:
+            chunks.append(current)
+            overlap = tail_text(current, overlap_tokens) if overlap_tokens else ""
+            overlap_size = count_tokens(overlap) if overlap else 0
+            if overlap and overlap_size + piece_tokens <= max_tokens:
+                current, current_tokens = overlap, overlap_size
+            else:
+                current, current_tokens = "", 0
+        current = f"{current} {piece}" if current else piece
+        current_tokens += piece_tokens
+    if current:
+        chunks.append(current)
+    return chunks
@@ -0,0 +1,137 @@
+import re
+from collections import namedtuple
+
+# One component of an RCW number: digits with an optional letter suffix,
+# as in Title 28A, chapter 43.21C or section 9A.04.010
+PART = r"\d+[A-Z]?"
+
+SECTION_NUMBER_PATTERN = re.compile(rf"^(?:RCW\s*)?({PART})\.({PART})\.({PART})$", re.IGNORECASE)
+
+# Every citation form, compiled once and matched in a single left-to-right
+# scan. Bare numbers ("3 days", "1.5") never match: chapters need a
+# "chapter"/"RCW" marker and titles need the word "title". A "chapters"
+# marker carries over a list: "chapters 2.04, 2.06 and 2.08".
+CHAPTER = rf"{PART}\.{PART}\b(?!\.\d)"
+CHAPTER_LIST_SEPARATOR = r"\s*(?:,\s*(?:and\s+|or\s+)?|\s(?:and|or)\s+)"
+CHAPTER_NUMBER_PATTERN = re.compile(CHAPTER, re.IGNORECASE)
+
+CITATION_PATTERN = re.compile(rf"""
+    \b(?P<range_start>{PART}\.{PART}\.{PART})
+        \s*(?:-|–|—|\bthrough\b|\bto\b)\s*
+        (?P<range_end>{PART}\.{PART}\.{PART}|\.{PART})\b
+  | \b(?P<section>{PART}\.{PART}\.{PART})\b
+  | \bchapters\s*(?P<chapter_list>{CHAPTER}(?:{CHAPTER_LIST_SEPARATOR}{CHAPTER})+)
+  | (?:\bchapters?|\bch\.|\bRCW)\s*(?P<chapter>{PART}\.{PART})\b(?!\.\d)
+  | \b(?P<chapter_suffix>{PART}\.{PART})\s+RCW\b
+  | \btitle\s+(?P<title>{PART})\b(?!\.\d)
+""", re.IGNORECASE | re.VERBOSE)
+
+# Section numbers anywhere in statute text, including ones run into the
+# neighbouring words where the text was joined from link elements
+# ("inRCW 2.04.020and"). Suffix letters are upper case in statute text.
+TEXT_SECTION_PATTERN = re.compile(r"(?<!\d)(?<!\d\.)(\d+[A-Z]?\.\d+[A-Z]?\.\d+[A-Z]?)(?!\d|\.\d)")
+
+Citation = namedtuple("Citation", ["kind", "title", "chapter", "section", "end"])
+Citation.__doc__ = """A normalized RCW citation.
+
+kind is "section", "range", "chapter" or "title". Ranges span section
+through end within one chapter. Unused fields are None.
+"""
+
+
+def parse_section_number(section_id):
+    """Split a section number into normalized (title, chapter, section) numbers.
+
+    "rcw 28a.150.010" -> ("28A", "28A.150", "28A.150.010"). Returns
+    (None, None, None) when section_id is not a section number.
+    """
+    match = SECTION_NUMBER_PATTERN.match((section_id or "").strip())
+    if not match:
+        return None, None, None
+    title, chapter, section = (part.upper() for part in match.groups())
+    return title, f"{title}.{chapter}", f"{title}.{chapter}.{section}"
+
+
+def section_citation(section_id):
+    title, chapter, section = parse_section_number(section_id)
+    return Citation("section", title, chapter, section, None) if section else None
+
+
+def chapter_citation(chapter_id):
+    chapter = chapter_id.upper()
+    return Citation("chapter", chapter.split(".")[0], chapter, None, None)
+
+
+def title_citation(title_id):
+    return Citation("title", title_id.upper(), None, None, None)
+
+
+def range_citation(start_id, end_id):
+    """Citation for "2.04.010-.030" or "2.04.010 through 2.04.030"."""
+    start = section_citation(start_id)
+    if end_id.startswith("."):
+        end_id = f"{start.chapter}{end_id}"
+    end = section_citation(end_id)
+    # A range across chapters is not a range; keep both ends as sections
+    if end.chapter != start.chapter:
+        return [start, end]
+    if end.section < start.section:
+        start, end = end, start
+    return [Citation("range", start.title, start.chapter, start.section, end.section)]
+
+
+def extract_citations(text):
+    """Extract every RCW citation in text, normalized and de-duplicated, in order."""
+    citations = []
+    for match in CITATION_PATTERN.finditer(text):
+        if match.group("range_start"):
+            found = range_citation(match.group("range_start"), match.group("range_end"))
+        elif match.group("section"):
+            found = [section_citation(match.group("section"))]
+        elif match.group("chapter_list"):
+            found = [chapter_citation(chapter) for chapter in CHAPTER_NUMBER_PATTERN.findall(match.group("chapter_list"))]
+        elif match.group("chapter") or match.group("chapter_suffix"):
+            found = [chapter_citation(match.group("chapter") or match.group("chapter_suffix"))]
+        else:
+            found = [title_citation(match.group("title"))]
+        for citation in found:
+            if citation not in citations:
+                citations.append(citation)
+
+    # "Title 1, Chapter 1.04, Section 1.04.010" names one section; drop the
+    # enclosing chapter and title when something inside them is cited
+    chapters = {citation.chapter for citation in citations if citation.kind in ("section", "range")}
+    titles = {citation.title for citation in citations if citation.kind != "title"}
+    return [
+        citation for citation in citations
+        if not (citation.kind == "chapter" and citation.chapter in chapters)
+        and not (citation.kind == "title" and citation.title in titles)
+    ]
+
+
+def cited_sections(text, section_id=None):
+    """Section numbers that text cross-references ("see RCW 2.04.020"), sorted.
+
+    Ranges contribute both ends. Chapter and title references cover too
+    many sections to be useful edges and are left out, as is section_id
+    itself.
+    """
+    cited = {parse_section_number(number)[2] for number in TEXT_SECTION_PATTERN.findall(text)}
+    for citation in extract_citations(text):
+        if citation.kind in ("section", "range"):
+            cited.add(citation.section)
+        if citation.kind == "range":
+            cited.add(citation.end)
+    cited.discard(parse_section_number(section_id)[2])
+    return sorted(cited)
+
+
+def format_citation(citation):
+    """Canonical text for a citation, e.g. "RCW 2.04.010-.030" or "chapter 2.04 RCW"."""
+    if citation.kind == "section":
+        return f"RCW {citation.section}"
+    if citation.kind == "range":
+        return f"RCW {citation.section}-{citation.end[len(citation.chapter):]}"
+    if citation.kind == "chapter":
+        return f"chapter {citation.chapter} RCW"
+    return f"Title {citation.title} RCW"
@@ -1,7 +1,16 @@
 import openai
 import psycopg2
+from psycopg2.extras import execute_values
 import numpy as np
+import hashlib
+import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from cache import bump_corpus_version
+from chunking import chunk_text, count_tokens, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS
+from metrics import REGISTRY
 
 # openai.api_key = os.getenv("OPENAI_API_KEY")
 openai.api_key = os.getenv("OPENAI_API_KEY")
@@ -14,42 +23,256 @@ DB_CONFIG = {
     "port": "5432"
 }
 
+EMBEDDING_MODEL = "text-embedding-ada-002"
+EMBEDDING_DIM = 1536
+
+# Pipeline tuning: rows pulled per server-side fetch, inputs per API request,
+# concurrent API requests and retry attempts on rate limits
+FETCH_CHUNK_SIZE = 1000
+EMBED_BATCH_SIZE = 100
+EMBED_CONCURRENCY = 4
+EMBED_RETRIES = 5
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+# Prometheus metrics, written to --metrics-file when a run finishes
+EMBED_REQUEST_SECONDS = REGISTRY.histogram("rcw_embed_request_seconds", "Embedding API latency per request", ["outcome"])
+EMBED_CHUNKS = REGISTRY.counter("rcw_embed_chunks_total", "Chunks embedded and committed")
+EMBED_TOKENS = REGISTRY.counter("rcw_embed_tokens_total", "Tokens sent to the embedding API")
+EMBED_RATE = REGISTRY.gauge("rcw_embed_rows_per_second", "Chunks embedded per second in the last run")
+
 def generate_embedding(text):
     """Generate OpenAI embedding for a given text."""
-    response = openai.Embedding.create(input=text, model="text-embedding-ada-002")
-    return np.array(response["data"][0]["embedding"], dtype=np.float32)
+    response = openai.embeddings.create(input=text, model=EMBEDDING_MODEL)
+    return np.array(response.data[0].embedding, dtype=np.float32)
 
-def update_embeddings():
-    """Generate embeddings for legal records that do not have embeddings."""
-    try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        cursor = conn.cursor()
+def generate_embeddings(texts):
+    """Embed several texts in one request. Returns (vectors, tokens used)."""
+    response = openai.embeddings.create(input=texts, model=EMBEDDING_MODEL)
+    data = sorted(response.data, key=lambda item: item.index)
+    vectors = [np.array(item.embedding, dtype=np.float32) for item in data]
+    return vectors, response.usage.total_tokens
 
-        cursor.execute("SELECT id, legal_text FROM legal_records WHERE embedding IS NULL;")
-        rows = cursor.fetchall()
+def local_embeddings(texts):
+    """Deterministic, network-free stand-in for generate_embeddings."""
+    vectors = []
+    tokens = 0
+    for text in texts:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(EMBEDDING_DIM).astype(np.float32)
+        vectors.append(vector / np.linalg.norm(vector))
+        tokens += count_tokens(text)
+    return vectors, tokens
 
+def embed_with_retry(embed_fn, texts, retries=EMBED_RETRIES):
+    """Call embed_fn, backing off exponentially on rate limits and transient errors."""
+    for attempt in range(retries):
+        start = time.perf_counter()
+        try:
+            result = embed_fn(texts)
+            EMBED_REQUEST_SECONDS.observe(time.perf_counter() - start, outcome="ok")
+            return result
+        except RETRYABLE_ERRORS as e:
+            EMBED_REQUEST_SECONDS.observe(time.perf_counter() - start, outcome="error")
+            if attempt == retries - 1:
+                raise
+            wait_time = 2 ** attempt
+            print(f"⚠️ Embedding request failed ({e}). Retrying in {wait_time}s...")
+            time.sleep(wait_time)
+
+def write_embeddings(conn, table, ids, vectors):
+    """Bulk-update one batch of embeddings in `table` and commit it."""
+    # pgvector parses the "[x, y, ...]" text form of a Python list
+    rows = [(row_id, str(vector.tolist())) for row_id, vector in zip(ids, vectors)]
+    with conn.cursor() as cursor:
+        execute_values(cursor, f"""
+            UPDATE {table} AS t SET embedding = v.embedding::vector
+            FROM (VALUES %s) AS v(id, embedding)
+            WHERE t.id = v.id
+        """, rows)
+    conn.commit()
+
+def chunk_pending_records(read_conn, write_conn, chunk_size=FETCH_CHUNK_SIZE,
+                          max_tokens=CHUNK_MAX_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS,
+                          vector_index=None):
+    """(Re)build chunks for sections whose chunks are missing or stale.
+
+    Chunks remember the md5 of the text they were cut from, so sections that
+    were chunked by an interrupted run keep their already embedded chunks.
+    Sections embedded whole, before chunking, have no chunks and are chunked
+    too; their section vector is cleared so the rollup replaces it.
+    """
+    cursor = read_conn.cursor(name="pending_chunks")
+    cursor.itersize = chunk_size
+    cursor.execute("""
+        SELECT r.id, r.legal_text FROM legal_records r
+        WHERE NOT EXISTS (
+            SELECT 1 FROM legal_chunks c
+            WHERE c.record_id = r.id AND c.source_hash = md5(r.legal_text)
+        )
+        ORDER BY r.id;
+    """)
+    chunked = 0
+    while True:
+        rows = cursor.fetchmany(chunk_size)
         if not rows:
-            print("✅ All records already have embeddings.")
-            return
+            break
+        chunk_rows = []
+        for record_id, legal_text in rows:
+            source_hash = hashlib.md5(legal_text.encode("utf-8")).hexdigest()
+            for index, piece in enumerate(chunk_text(legal_text, max_tokens, overlap_tokens)):
+                chunk_rows.append((record_id, index, piece, count_tokens(piece), source_hash))
+        with write_conn.cursor() as write_cursor:
+            write_cursor.execute("DELETE FROM legal_chunks WHERE record_id = ANY(%s)", ([row[0] for row in rows],))
+            write_cursor.execute("UPDATE legal_records SET embedding = NULL WHERE id = ANY(%s) AND embedding IS NOT NULL",
+                                 ([row[0] for row in rows],))
+            execute_values(write_cursor, """
+                INSERT INTO legal_chunks (record_id, chunk_index, chunk_text, token_count, source_hash) VALUES %s
+            """, chunk_rows)
+        write_conn.commit()
+        if vector_index is not None:
+            vector_index.remove_records([row[0] for row in rows])
+        chunked += len(rows)
+    cursor.close()
+    read_conn.commit()
+    return chunked
+
+def embed_pending_chunks(read_conn, write_conn, stats, embed_fn=generate_embeddings,
+                         batch_size=EMBED_BATCH_SIZE, concurrency=EMBED_CONCURRENCY,
+                         chunk_size=FETCH_CHUNK_SIZE, vector_index=None):
+    """Embed every chunk without a vector, committing each batch as it returns."""
+    def finish(future):
+        ids, record_ids, (vectors, tokens) = future.result()
+        write_embeddings(write_conn, "legal_chunks", ids, vectors)
+        if vector_index is not None:
+            vector_index.add(ids, record_ids, vectors)
+        stats["chunks"] += len(ids)
+        stats["tokens"] += tokens
+        stats["batches"] += 1
+        EMBED_CHUNKS.inc(len(ids))
+        EMBED_TOKENS.inc(tokens)
 
-        print(f"🔄 Generating embeddings for {len(rows)} records...")
+    def embed_batch(batch):
+        ids = [row[0] for row in batch]
+        record_ids = [row[1] for row in batch]
+        return ids, record_ids, embed_with_retry(embed_fn, [row[2] for row in batch])
 
-        for row in rows:
-            embedding = generate_embedding(row[1])  # NumPy array
-            embedding_bytes = embedding.tobytes()  # Convert to bytes
+    cursor = read_conn.cursor(name="pending_embeddings")
+    cursor.itersize = chunk_size
+    cursor.execute("SELECT id, record_id, chunk_text FROM legal_chunks WHERE embedding IS NULL ORDER BY id;")
 
-            cursor.execute("UPDATE legal_records SET embedding = %s WHERE id = %s", (embedding_bytes, row[0]))
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        in_flight = set()
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for i in range(0, len(rows), batch_size):
+                # Backpressure: never hold more than 2x concurrency batches
+                while len(in_flight) >= concurrency * 2:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        finish(future)
+                in_flight.add(pool.submit(embed_batch, rows[i:i + batch_size]))
 
-        conn.commit()
-        print("✅ Embeddings updated successfully!")
+        for future in in_flight:
+            finish(future)
+    cursor.close()
+    read_conn.commit()
+
+def rollup_section_embeddings(read_conn, write_conn, chunk_size=FETCH_CHUNK_SIZE):
+    """Set each fully embedded section's vector to the normalized mean of its chunks.
+
+    Means are normalized here rather than with l2_normalize, which needs
+    pgvector 0.7, and written back in batches of `chunk_size`.
+    """
+    cursor = read_conn.cursor(name="pending_rollups")
+    cursor.itersize = chunk_size
+    cursor.execute("""
+        SELECT c.record_id, avg(c.embedding)::text
+        FROM legal_chunks c
+        JOIN legal_records pending ON pending.id = c.record_id
+        WHERE pending.embedding IS NULL AND c.source_hash = md5(pending.legal_text)
+        GROUP BY c.record_id
+        HAVING count(*) = count(c.embedding)
+    """)
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        vectors = [np.array(json.loads(mean), dtype=np.float32) for _, mean in rows]
+        write_embeddings(write_conn, "legal_records", [row[0] for row in rows],
+                         [vector / (np.linalg.norm(vector) or 1.0) for vector in vectors])
+    cursor.close()
+    read_conn.commit()
+
+def update_embeddings(embed_fn=generate_embeddings, batch_size=EMBED_BATCH_SIZE,
+                      concurrency=EMBED_CONCURRENCY, chunk_size=FETCH_CHUNK_SIZE,
+                      vector_index=None, metrics_file=None):
+    """Generate embeddings for legal records that do not have embeddings.
+
+    New or changed sections are first split into chunks (see chunking.py).
+    Chunks are streamed through a server-side cursor and embedded in
+    multi-input batches by up to `concurrency` parallel requests. Each batch
+    is committed as soon as it returns, so a crash only loses in-flight work.
+    Finally each section gets the mean of its chunk vectors.
+    If a NumpyVectorIndex is given, new chunks are merged into its snapshot.
+    Returns a dict of throughput stats; `metrics_file` also receives them as
+    Prometheus metrics.
+    """
+    read_conn = psycopg2.connect(**DB_CONFIG)
+    write_conn = psycopg2.connect(**DB_CONFIG)
+    stats = {"sections": 0, "chunks": 0, "tokens": 0, "batches": 0, "seconds": 0.0}
+    start = time.perf_counter()
+
+    try:
+        stats["sections"] = chunk_pending_records(read_conn, write_conn, chunk_size, vector_index=vector_index)
+        embed_pending_chunks(read_conn, write_conn, stats, embed_fn, batch_size, concurrency, chunk_size,
+                             vector_index)
+        rollup_section_embeddings(read_conn, write_conn, chunk_size)
+
+        stats["seconds"] = time.perf_counter() - start
+        if not stats["chunks"]:
+            print("✅ All records already have embeddings.")
+        else:
+            seconds = stats["seconds"] or 1e-9
+            print(f"✅ Embedded {stats['chunks']} chunks from {stats['sections']} records in {stats['batches']} batches "
+                  f"({stats['chunks'] / seconds:.1f} rows/sec, {stats['tokens'] / seconds:.1f} tokens/sec)")
+        return stats
 
     except Exception as e:
-        print(f"❌ Error: {e}")
+        print(f"❌ Error: {e} (committed {stats['chunks']} chunks before failing)")
+        return stats
 
     finally:
-        if conn:
-            cursor.close()
-            conn.close()
+        # Committed chunks are already in the database, so keep the snapshot
+        # and the API's response cache in step with them
+        if vector_index is not None:
+            vector_index.save()
+        if stats["chunks"]:
+            write_conn.rollback()
+            with write_conn.cursor() as cursor:
+                bump_corpus_version(cursor)
+            write_conn.commit()
+        read_conn.close()
+        write_conn.close()
+        if metrics_file:
+            EMBED_RATE.set(stats["chunks"] / (time.perf_counter() - start))
+            REGISTRY.write_textfile(metrics_file)
+
+if __name__ == "__main__":
+    import argparse
+    from vector_index import NumpyVectorIndex
 
-update_embeddings()
+    parser = argparse.ArgumentParser(description="Embed new or changed legal_records sections.")
+    parser.add_argument("--vector-index", metavar="PATH", help="also update this NumPy index snapshot")
+    parser.add_argument("--metrics-file", metavar="PATH", help="write Prometheus metrics here when done")
+    args = parser.parse_args()
 
+    update_embeddings(vector_index=NumpyVectorIndex(args.vector_index).load() if args.vector_index else None,
+                      metrics_file=args.metrics_file)
@@ -1,10 +1,30 @@
 
-from fastapi import FastAPI
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from fastapi import FastAPI, Query
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
+import json
 import openai
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+from pydantic import BaseModel, Field
 import re
+import threading
+import time
+from typing import List, Optional
+
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    BrotliMiddleware = None
+
+from cache import embedding_cache, normalize_question, read_corpus_version, response_cache
+from citations import Citation, extract_citations, parse_section_number
+from metrics import REGISTRY, collect_timings, run_in_context, span
+from snippets import make_snippet
+from vector_index import NumpyVectorIndex, VECTOR_INDEX_PATH, CHUNK_CANDIDATES
 
-app = FastAPI()
 DB_CONFIG = {
     "dbname": "legal_db",
     "user": "legal_user",
@@ -19,197 +39,872 @@ from dotenv import load_dotenv
 
 # load_dotenv()
 openai.api_key = os.getenv("OPENAI_API_KEY")
+
+# Semantic search backend: "pgvector" (ANN index in Postgres) or "numpy"
+# (in-process snapshot written by vector_index.py / update_embeddings)
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "pgvector")
+vector_index = NumpyVectorIndex(os.getenv("VECTOR_INDEX_PATH", VECTOR_INDEX_PATH))
+
+# Question embeddings cached in memory (LRU + TTL), and in SQLite when
+# EMBEDDING_CACHE_PATH is set so they survive restarts
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "1024"))
+EMBEDDING_CACHE_TTL = float(os.getenv("EMBEDDING_CACHE_TTL", str(7 * 24 * 3600)))
+query_embedding_cache = embedding_cache(
+    EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_TTL, os.getenv("EMBEDDING_CACHE_PATH")
+)
+
+# Whole /query responses cached per (corpus version, top_k, question) for up
+# to RESPONSE_CACHE_TTL seconds.
+# RESPONSE_CACHE_PATH adds a SQLite tier shared by all workers on a host;
+# the corpus version is re-read at most every CORPUS_VERSION_CHECK seconds.
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "4096"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+CORPUS_VERSION_CHECK = float(os.getenv("CORPUS_VERSION_CHECK", "5"))
+query_response_cache = response_cache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, os.getenv("RESPONSE_CACHE_PATH"))
+corpus_version = {"version": None, "checked_at": 0.0}
+
+# ANN recall/latency knobs: HNSW candidate list size and IVFFlat lists probed
+HNSW_EF_SEARCH = 40
+IVFFLAT_PROBES = 10
+
+# Hybrid retrieval: candidates taken from each leg, the reciprocal-rank-fusion
+# constant, and the default/maximum number of hits returned per question
+HYBRID_CANDIDATES = 20
+RRF_K = 60
+DEFAULT_TOP_K = int(os.getenv("DEFAULT_TOP_K", "1"))
+MAX_TOP_K = 20
+
+# Most questions accepted by one /query/batch request (OpenAI takes up to
+# 2048 embedding inputs per request)
+QUERY_BATCH_MAX = int(os.getenv("QUERY_BATCH_MAX", "1000"))
+
+# Responses of at least COMPRESS_MIN_SIZE bytes are compressed for clients
+# that accept it
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1000"))
+
+# Most cited and most citing sections listed per hit with related=true
+RELATED_LIMIT = int(os.getenv("RELATED_LIMIT", "20"))
+
+# Threads that run the full-text and vector legs of a query side by side
+retrieval_pool = ThreadPoolExecutor(max_workers=int(os.getenv("RETRIEVAL_WORKERS", "16")))
+
+# Prometheus metrics served on /metrics. The stage spans also make up the
+# per-request breakdown returned by /query?timings=true
+QUERY_STAGE_SECONDS = REGISTRY.histogram(
+    "rcw_query_stage_seconds", "Time spent in each stage of answering a question", ["stage"]
+)
+QUERY_SECONDS = REGISTRY.histogram("rcw_query_seconds", "End-to-end /query latency", ["method", "cache"])
+QUERIES = REGISTRY.counter("rcw_queries_total", "Questions answered by /query and /query/batch", ["method", "cache"])
+QUERY_BATCH_SECONDS = REGISTRY.histogram("rcw_query_batch_seconds", "End-to-end /query/batch latency")
+QUERY_BATCH_SIZE = REGISTRY.histogram(
+    "rcw_query_batch_size", "Questions per /query/batch request", buckets=(1, 10, 50, 100, 250, 500, 1000)
+)
+
+# Connection pool shared by all requests, sized by DB_POOL_MIN/DB_POOL_MAX.
+# psycopg2 closes returned connections beyond DB_POOL_MIN, so it is also the
+# number kept open between requests; it defaults to DB_POOL_MAX.
+# Requests wait up to DB_POOL_TIMEOUT seconds for a free connection.
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "20"))
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", str(DB_POOL_MAX)))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+db_pool = None
+db_pool_slots = None
+
+def open_pool(min_size=DB_POOL_MIN, max_size=DB_POOL_MAX):
+    global db_pool, db_pool_slots
+    db_pool = ThreadedConnectionPool(min_size, max_size, **DB_CONFIG)
+    # ThreadedConnectionPool raises when exhausted; the semaphore makes callers wait instead
+    db_pool_slots = threading.BoundedSemaphore(max_size)
+
+def close_pool():
+    global db_pool
+    if db_pool is not None:
+        db_pool.closeall()
+        db_pool = None
+
+@asynccontextmanager
+async def lifespan(app):
+    open_pool()
+    try:
+        yield
+    finally:
+        close_pool()
+
+app = FastAPI(lifespan=lifespan)
+
+# Brotli when brotli-asgi is installed (falling back to gzip for clients
+# without it), gzip otherwise. Streamed responses are flushed per chunk.
+if BrotliMiddleware is not None:
+    app.add_middleware(BrotliMiddleware, minimum_size=COMPRESS_MIN_SIZE, gzip_fallback=True)
+else:
+    app.add_middleware(GZipMiddleware, minimum_size=COMPRESS_MIN_SIZE, compresslevel=6)
+
 # Function to get a database connection
+@contextmanager
 def get_connection():
-    return psycopg2.connect(**DB_CONFIG)
+    """Borrow a pooled connection, or open a one-off one when no pool is running
+    (scripts and benchmarks that call these functions directly)."""
+    if db_pool is None:
+        with span(QUERY_STAGE_SECONDS, "connection"):
+            conn = psycopg2.connect(**DB_CONFIG)
+        try:
+            yield conn
+        finally:
+            conn.close()
+        return
+    
+    with span(QUERY_STAGE_SECONDS, "connection"):
+        if not db_pool_slots.acquire(timeout=DB_POOL_TIMEOUT):
+            raise RuntimeError("Timed out waiting for a database connection")
+        try:
+            conn = db_pool.getconn()
+        except Exception:
+            db_pool_slots.release()
+            raise
+    try:
+        yield conn
+    finally:
+        # End the read transaction (and any SET LOCAL) before reuse. A
+        # connection that can't be rolled back is closed, and the pool and
+        # its slot get the connection back either way.
+        try:
+            if not conn.closed:
+                conn.rollback()
+            broken = bool(conn.closed)
+        except psycopg2.Error:
+            broken = True
+        try:
+            db_pool.putconn(conn, close=broken)
+        finally:
+            db_pool_slots.release()
 
-# Function to generate OpenAI embedding
+def current_corpus_version():
+    """Corpus version from the database, cached for CORPUS_VERSION_CHECK seconds"""
+    now = time.monotonic()
+    if corpus_version["version"] is None or now - corpus_version["checked_at"] >= CORPUS_VERSION_CHECK:
+        with span(QUERY_STAGE_SECONDS, "corpus_version"), get_connection() as conn:
+            corpus_version["version"] = read_corpus_version(conn.cursor())
+        corpus_version["checked_at"] = now
+    return corpus_version["version"]
+
+# Function to generate OpenAI embedding, reusing cached ones for repeat questions
 def get_embedding(text):
-    response = openai.embeddings.create(model="text-embedding-ada-002", input=[text])
-    return response.data[0].embedding
+    key = normalize_question(text)
+    embedding = query_embedding_cache.get(key)
+    if embedding is not None:
+        return embedding
+    
+    with span(QUERY_STAGE_SECONDS, "embedding"):
+        response = openai.embeddings.create(model="text-embedding-ada-002", input=[text])
+    embedding = response.data[0].embedding
+    query_embedding_cache.set(key, embedding)
+    return embedding
 
-def direct_rcw_lookup(title=None, chapter=None, section=None):
-    """Directly look up RCW content based on title, chapter, and optional section"""
-    conn = get_connection()
-    cursor = conn.cursor()
+def get_embeddings(texts):
+    """get_embedding for many texts: cached ones are reused, the rest embedded in one request"""
+    keys = [normalize_question(text) for text in texts]
+    embeddings = {key: query_embedding_cache.get(key) for key in keys}
+    missing = {}
+    for key, text in zip(keys, texts):
+        if embeddings[key] is None:
+            missing.setdefault(key, text)
     
-    query = "SELECT id, title, chapter, section, legal_text, citation_link FROM legal_records WHERE TRUE"
+    if missing:
+        with span(QUERY_STAGE_SECONDS, "embedding"):
+            response = openai.embeddings.create(model="text-embedding-ada-002", input=list(missing.values()))
+        for key, item in zip(missing, sorted(response.data, key=lambda item: item.index)):
+            embeddings[key] = item.embedding
+            query_embedding_cache.set(key, item.embedding)
+    return [embeddings[key] for key in keys]
+
+def citation_number(value):
+    """Normalize "Title 28a" / "Chapter 1.04" / "1.04.010" to the bare number."""
+    if not value:
+        return None
+    match = re.search(r"\d+[A-Z]?(?:\.\d+[A-Z]?)*", value.upper())
+    return match.group(0) if match else None
+
+def lookup_citations(citations, limit=50):
+    """Resolve parsed citations in one query, returning rows in citation order"""
+    return lookup_citations_batch([citations], [limit])[0]
+
+def lookup_citations_batch(citation_lists, limits):
+    """Resolve the citations of many questions in one query, one row list per question
+
+    All cited sections of all questions are matched at once by joining the
+    unnested (question, position, section number) list on the section_num
+    index; each range, chapter or title adds an indexed subquery capped at
+    that question's limit. Rows come back in citation order, and rows a
+    question cites more than once are returned once.
+    """
+    results = [[] for _ in citation_lists]
+    columns = "r.id, r.title, r.chapter, r.section, r.legal_text, r.citation_link"
+    parts = []
     params = []
     
-    if title:
-        query += " AND title ILIKE %s"
-        params.append(f"%{title}%")
+    sections = [
+        (question, position, citation.section)
+        for question, citations in enumerate(citation_lists)
+        for position, citation in enumerate(citations) if citation.kind == "section"
+    ]
+    if sections:
+        parts.append(f"""
+            (SELECT p.question, p.position, r.section_num, {columns}
+             FROM unnest(%s::int[], %s::int[], %s::text[]) AS p(question, position, section_num)
+             JOIN legal_records r ON r.section_num = p.section_num)
+        """)
+        params += [list(column) for column in zip(*sections)]
     
-    if chapter:
-        query += " AND chapter ILIKE %s"
-        params.append(f"%{chapter}%")
+    for question, (citations, limit) in enumerate(zip(citation_lists, limits)):
+        for position, citation in enumerate(citations):
+            if citation.kind == "range":
+                condition, values = "r.chapter_num = %s AND r.section_num BETWEEN %s AND %s", [citation.chapter, citation.section, citation.end]
+            elif citation.kind == "chapter":
+                condition, values = "r.chapter_num = %s", [citation.chapter]
+            elif citation.kind == "title":
+                condition, values = "r.title_num = %s", [citation.title]
+            else:
+                continue
+            parts.append(f"""
+                (SELECT %s::int, %s::int, r.section_num, {columns}
+                 FROM legal_records r WHERE {condition}
+                 ORDER BY r.section_num LIMIT %s)
+            """)
+            params += [question, position, *values, limit]
     
-    if section:
-        query += " AND section ILIKE %s"
-        params.append(f"%{section}%")
-    
-    cursor.execute(query, params)
-    results = cursor.fetchall()
-    conn.close()
+    if not parts:
+        return results
+    with span(QUERY_STAGE_SECONDS, "direct_lookup"), get_connection() as conn:
+        cursor = conn.cursor()
+        # Wrapped, since a lone "(SELECT ... ORDER BY ... LIMIT)" can't take a second ORDER BY
+        cursor.execute("SELECT * FROM (" + " UNION ALL ".join(parts) + ") AS hits ORDER BY 1, 2, 3", params)
+        rows = cursor.fetchall()
     
+    seen = set()
+    for row in rows:
+        if (row[0], row[3]) not in seen:
+            seen.add((row[0], row[3]))
+            results[row[0]].append(row[3:])
     return results
 
-def extract_rcw_references(text):
-    """Extract RCW references from the query text"""
-    # Pattern for full RCW reference (Title, Chapter, Section)
-    full_pattern = r"(?:RCW|rcw)?\s*(?:Title\s*)?(\d+)(?:\s*,?\s*Chapter\s*)?(\d+\.\d+)?(?:\s*,?\s*Section\s*)?(\d+\.\d+\.\d+)?"
-    
-    # Pattern for direct section reference without Title/Chapter prefix
-    section_pattern = r"(?:RCW|rcw)?\s*(\d+\.\d+\.\d+)"
-    
-    # Try full pattern first
-    match = re.search(full_pattern, text, re.IGNORECASE)
-    if match:
-        title, chapter, section = match.groups()
-        return {
-            "title": f"Title {title}" if title else None,
-            "chapter": f"Chapter {chapter}" if chapter else None,
-            "section": section
-        }
+def direct_rcw_lookup(title=None, chapter=None, section=None, limit=50):
+    """Directly look up RCW content based on title, chapter, and optional section
+
+    Uses the most specific citation given, as an exact match on the indexed
+    title_num/chapter_num/section_num columns, in citation order.
+    """
+    title, chapter, section = citation_number(title), citation_number(chapter), citation_number(section)
     
-    # Try direct section reference
-    section_match = re.search(section_pattern, text, re.IGNORECASE)
-    if section_match:
-        section = section_match.group(1)
-        # Extract title and chapter from section
-        parts = section.split('.')
-        if len(parts) >= 2:
-            title = parts[0]
-            chapter = f"{parts[0]}.{parts[1]}"
-            return {
-                "title": f"Title {title}",
-                "chapter": f"Chapter {chapter}",
-                "section": section
-            }
+    if section:
+        citation = Citation("section", *parse_section_number(section), None)
+    elif chapter:
+        citation = Citation("chapter", chapter.split(".")[0], chapter, None, None)
+    elif title:
+        citation = Citation("title", title, None, None, None)
+    else:
+        return []
     
-    return None
+    if citation.kind == "section" and citation.section is None:
+        return []
+    return lookup_citations([citation], limit)
+
+def extract_rcw_references(text):
+    """Extract all RCW references (sections, ranges, chapters, titles) from the query text"""
+    return extract_citations(text)
 
-def get_related_law(query_text):
-    """Comprehensive search function that combines direct lookup with semantic search"""
+def get_related_law(query_text, k=DEFAULT_TOP_K):
+    """Comprehensive search function that combines direct lookup with hybrid search
+
+    Returns the best row as "result" and the hits (row, score, methods) as
+    "results", or None when nothing matches. Every cited section is
+    returned, so multi-citation questions may yield more than k hits.
+    """
     # Step 1: Check if the query contains RCW references
-    rcw_refs = extract_rcw_references(query_text)
+    with span(QUERY_STAGE_SECONDS, "citations"):
+        rcw_refs = extract_rcw_references(query_text)
     
-    # Step 2: If we have RCW references, try direct lookup first
+    # Step 2: If we have RCW references, resolve them all in one direct lookup
     if rcw_refs:
-        direct_results = direct_rcw_lookup(
-            rcw_refs.get("title"), 
-            rcw_refs.get("chapter"), 
-            rcw_refs.get("section")
-        )
+        direct_results = lookup_citations(rcw_refs, limit=k)
         
         if direct_results:
             return {
                 "result": direct_results[0],
+                "results": [{"row": row, "score": None, "methods": ["direct_lookup"]} for row in direct_results],
                 "method": "direct_lookup"
             }
     
-    # Step 3: If direct lookup fails or no RCW reference, use semantic search
-    query_embedding = get_embedding(query_text)
-    
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    # Using pgvector's L2 distance operator <-> for similarity search
-    cursor.execute("""
-        SELECT id, title, chapter, section, legal_text, citation_link
-        FROM legal_records
-        WHERE embedding IS NOT NULL
-        ORDER BY embedding <-> %s
-        LIMIT 1
-    """, (query_embedding,))
-    
-    result = cursor.fetchone()
-    conn.close()
+    # Step 3: If direct lookup fails or no RCW reference, fuse full-text and semantic search
+    hits = hybrid_search(query_text, k)
     
-    if result:
+    if hits:
         return {
-            "result": result,
-            "method": "semantic_search"
+            "result": hits[0]["row"],
+            "results": hits,
+            "method": "hybrid_search"
         }
     else:
         return None
 
-def search_by_keywords(keywords):
-    """Search for laws containing specific keywords"""
-    conn = get_connection()
-    cursor = conn.cursor()
+def get_related_law_batch(questions, ks):
+    """get_related_law for many questions, with question i asking for ks[i] hits
+
+    Citations of all questions are resolved in one direct lookup; the rest
+    go through one batched hybrid search. Results are in input order.
+    """
+    with span(QUERY_STAGE_SECONDS, "citations"):
+        rcw_refs = [extract_rcw_references(question) for question in questions]
     
-    query = "SELECT id, title, chapter, section, legal_text, citation_link FROM legal_records WHERE "
-    conditions = []
-    params = []
+    results = [None] * len(questions)
+    for i, direct_results in enumerate(lookup_citations_batch(rcw_refs, ks)):
+        if direct_results:
+            results[i] = {
+                "result": direct_results[0],
+                "results": [{"row": row, "score": None, "methods": ["direct_lookup"]} for row in direct_results],
+                "method": "direct_lookup"
+            }
+    
+    pending = [i for i, result in enumerate(results) if result is None]
+    if pending:
+        batch_hits = hybrid_search_batch([questions[i] for i in pending], [ks[i] for i in pending])
+        for i, hits in zip(pending, batch_hits):
+            if hits:
+                results[i] = {"result": hits[0]["row"], "results": hits, "method": "hybrid_search"}
+    return results
+
+def fetch_records(record_ids):
+    """Fetch legal_records rows by id, preserving the order of record_ids."""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT id, title, chapter, section, legal_text, citation_link FROM legal_records WHERE id = ANY(%s)",
+            (list(record_ids),)
+        )
+        rows = {row[0]: row for row in cursor.fetchall()}
     
-    for keyword in keywords:
-        conditions.append("legal_text ILIKE %s")
-        params.append(f"%{keyword}%")
+    return [rows[record_id] for record_id in record_ids if record_id in rows]
+
+def pgvector_search(query_embedding, k=1):
+    """Nearest sections by their closest chunk, using the pgvector ANN index"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SET LOCAL hnsw.ef_search = %s", (HNSW_EF_SEARCH,))
+        cursor.execute("SET LOCAL ivfflat.probes = %s", (IVFFLAT_PROBES,))
     
-    query += " AND ".join(conditions)
-    cursor.execute(query, params)
+        # Using pgvector's L2 distance operator <-> over section chunks, then
+        # ranking each section by its closest chunk
+        cursor.execute("""
+            SELECT r.id, r.title, r.chapter, r.section, r.legal_text, r.citation_link
+            FROM (
+                SELECT record_id, min(distance) AS distance
+                FROM (
+                    SELECT record_id, embedding <-> %s::vector AS distance
+                    FROM legal_chunks
+                    WHERE embedding IS NOT NULL
+                    ORDER BY distance
+                    LIMIT %s
+                ) AS chunk_hits
+                GROUP BY record_id
+            ) AS hits
+            JOIN legal_records r ON r.id = hits.record_id
+            ORDER BY hits.distance
+            LIMIT %s
+        """, (str(query_embedding), max(CHUNK_CANDIDATES, k), k))
     
-    results = cursor.fetchall()
-    conn.close()
+        results = cursor.fetchall()
     
     return results
 
-@app.get("/query")
-def query_law(question: str):
+def pgvector_search_batch(query_embeddings, k=1):
+    """pgvector_search for many embeddings in one query, one row list per embedding"""
+    results = [[] for _ in query_embeddings]
+    if not query_embeddings:
+        return results
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SET LOCAL hnsw.ef_search = %s", (HNSW_EF_SEARCH,))
+        cursor.execute("SET LOCAL ivfflat.probes = %s", (IVFFLAT_PROBES,))
+    
+        # The per-embedding search of pgvector_search, run by a lateral join
+        # over the unnested embeddings so each one still uses the ANN index
+        cursor.execute("""
+            SELECT q.question, r.id, r.title, r.chapter, r.section, r.legal_text, r.citation_link
+            FROM unnest(%s::vector[]) WITH ORDINALITY AS q(embedding, question)
+            CROSS JOIN LATERAL (
+                SELECT record_id, min(distance) AS distance
+                FROM (
+                    SELECT record_id, embedding <-> q.embedding AS distance
+                    FROM legal_chunks
+                    WHERE embedding IS NOT NULL
+                    ORDER BY distance
+                    LIMIT %s
+                ) AS chunk_hits
+                GROUP BY record_id
+                ORDER BY distance
+                LIMIT %s
+            ) AS hits
+            JOIN legal_records r ON r.id = hits.record_id
+            ORDER BY q.question, hits.distance
+        """, ([str(embedding) for embedding in query_embeddings], max(CHUNK_CANDIDATES, k), k))
+    
+        for row in cursor.fetchall():
+            results[row[0] - 1].append(row[1:])
+    
+    return results
+
+def numpy_search(query_embedding, k=1):
+    """Nearest sections by their closest chunk, using the in-process NumPy index"""
+    hits = vector_index.refresh().search(query_embedding, k, CHUNK_CANDIDATES)
+    if not hits:
+        return []
+    return fetch_records([record_id for record_id, _ in hits])
+
+def numpy_search_batch(query_embeddings, k=1):
+    """numpy_search for many embeddings: one matrix multiply and one record fetch"""
+    batch_hits = vector_index.refresh().search_many(query_embeddings, k, CHUNK_CANDIDATES)
+    record_ids = list({record_id: None for hits in batch_hits for record_id, _ in hits})
+    rows = {row[0]: row for row in fetch_records(record_ids)} if record_ids else {}
+    return [[rows[record_id] for record_id, _ in hits if record_id in rows] for hits in batch_hits]
+
+SEARCH_BACKENDS = {
+    "pgvector": pgvector_search,
+    "numpy": numpy_search,
+}
+
+BATCH_SEARCH_BACKENDS = {
+    "pgvector": pgvector_search_batch,
+    "numpy": numpy_search_batch,
+}
+
+def semantic_search(query_embedding, k=1):
+    """Top-k legal_records rows for an embedding from the configured backend"""
+    with span(QUERY_STAGE_SECONDS, "vector_search"):
+        return SEARCH_BACKENDS[SEARCH_BACKEND](query_embedding, k)
+
+def semantic_search_batch(query_embeddings, k=1):
+    """semantic_search for many embeddings in one backend call"""
+    with span(QUERY_STAGE_SECONDS, "vector_search"):
+        return BATCH_SEARCH_BACKENDS[SEARCH_BACKEND](query_embeddings, k)
+
+def search_by_keywords(keywords, limit=2):
+    """Search for laws containing specific keywords, best matches first
+
+    Keywords are OR-ed into an English tsquery (stemmed, stopwords dropped)
+    and matched against the GIN-indexed search_vector, ranked by ts_rank_cd.
+    """
+    terms = keyword_query(keywords)
+    if not terms:
+        return []
+    
+    with span(QUERY_STAGE_SECONDS, "full_text"), get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id, title, chapter, section, legal_text, citation_link
+            FROM legal_records, to_tsquery('english', %s) AS query
+            WHERE search_vector @@ query
+            ORDER BY ts_rank_cd(search_vector, query) DESC
+            LIMIT %s
+        """, (terms, limit))
+        results = cursor.fetchall()
+    
+    return results
+
+def keyword_query(keywords):
+    """OR the words of the keywords into tsquery text ("" when there are none)."""
+    return " | ".join(word for keyword in keywords for word in re.findall(r"\w+", keyword))
+
+def search_by_keywords_batch(keyword_lists, limit=2):
+    """search_by_keywords for many keyword lists in one query, one row list per list"""
+    results = [[] for _ in keyword_lists]
+    queries = [(i, keyword_query(keywords)) for i, keywords in enumerate(keyword_lists)]
+    queries = [(i, terms) for i, terms in queries if terms]
+    if not queries:
+        return results
+    
+    with span(QUERY_STAGE_SECONDS, "full_text"), get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT q.question, hits.id, hits.title, hits.chapter, hits.section, hits.legal_text, hits.citation_link
+            FROM unnest(%s::int[], %s::text[]) AS q(question, terms)
+            CROSS JOIN LATERAL (
+                SELECT id, title, chapter, section, legal_text, citation_link,
+                       ts_rank_cd(search_vector, query) AS rank
+                FROM legal_records, to_tsquery('english', q.terms) AS query
+                WHERE search_vector @@ query
+                ORDER BY rank DESC
+                LIMIT %s
+            ) AS hits
+            ORDER BY q.question, hits.rank DESC
+        """, ([i for i, _ in queries], [terms for _, terms in queries], limit))
+        for row in cursor.fetchall():
+            results[row[0]].append(row[1:])
+    
+    return results
+
+# Words that mark a question as comparative; they are not search terms
+COMPARATIVE_KEYWORDS = ["compare", "difference", "differ", "versus", "vs"]
+
+def search_terms(question):
+    return [word for word in re.findall(r'\b\w+\b', question.lower()) if word not in COMPARATIVE_KEYWORDS]
+
+def reciprocal_rank_fusion(ranked_lists, k, rrf_k=RRF_K):
+    """Fuse {method: ranked rows} into the top-k hits by reciprocal rank
+
+    Each row scores sum(1 / (rrf_k + rank)) over the lists it appears in.
+    """
+    hits = {}
+    for method, rows in ranked_lists.items():
+        for rank, row in enumerate(rows, start=1):
+            hit = hits.setdefault(row[0], {"row": row, "score": 0.0, "methods": []})
+            hit["score"] += 1.0 / (rrf_k + rank)
+            hit["methods"].append(method)
+    return sorted(hits.values(), key=lambda hit: hit["score"], reverse=True)[:k]
+
+def hybrid_search(question, k=DEFAULT_TOP_K, candidates=HYBRID_CANDIDATES):
+    """Run the full-text and semantic legs concurrently and fuse their rankings
+
+    A failing leg is logged and skipped; if every leg fails the last error is raised.
+    """
+    limit = max(candidates, k)
+    legs = {
+        "full_text": run_in_context(retrieval_pool, search_by_keywords, search_terms(question), limit),
+        "semantic": run_in_context(retrieval_pool, lambda: semantic_search(get_embedding(question), limit)),
+    }
+    
+    ranked = {}
+    error = None
+    for method, future in legs.items():
+        try:
+            ranked[method] = future.result()
+        except Exception as e:
+            print(f"⚠️ {method} search failed: {e}")
+            error = e
+    if not ranked:
+        raise error
+    
+    with span(QUERY_STAGE_SECONDS, "fusion"):
+        return reciprocal_rank_fusion(ranked, k)
+
+def hybrid_search_batch(questions, ks, candidates=HYBRID_CANDIDATES):
+    """hybrid_search for many questions, with question i asking for ks[i] hits
+
+    Each leg runs once for the whole batch: one full-text query, one
+    embedding request and one vector search.
+    """
+    limit = max(candidates, *ks)
+    legs = {
+        "full_text": run_in_context(retrieval_pool, search_by_keywords_batch,
+                                    [search_terms(question) for question in questions], limit),
+        "semantic": run_in_context(retrieval_pool, lambda: semantic_search_batch(get_embeddings(questions), limit)),
+    }
+    
+    ranked = {}
+    error = None
+    for method, future in legs.items():
+        try:
+            ranked[method] = future.result()
+        except Exception as e:
+            print(f"⚠️ {method} search failed: {e}")
+            error = e
+    if not ranked:
+        raise error
+    
+    with span(QUERY_STAGE_SECONDS, "fusion"):
+        return [
+            reciprocal_rank_fusion({method: rows[i] for method, rows in ranked.items()}, k)
+            for i, k in enumerate(ks)
+        ]
+
+def format_law(hit):
+    """Response entry for one hit from get_related_law / hybrid_search"""
+    row = hit["row"]
+    return {
+        "Title": row[1],
+        "Chapter": row[2],
+        "Section": row[3],
+        "Text": row[4],
+        "Citation": row[5],
+        "Score": hit["score"],
+        "Methods": hit["methods"]
+    }
+
+def snippet_law(law, question):
+    """A response entry with its full text replaced by the best-matching passage"""
+    law = dict(law)
+    law["Snippet"] = make_snippet(law.pop("Text", None), question)
+    return law
+
+def snippet_response(response, question):
+    """A copy of a /query response carrying snippets instead of full section texts"""
+    response = dict(response)
+    if "relevant_law" in response:
+        response["relevant_law"] = snippet_law(response["relevant_law"], question)
+    if "relevant_laws" in response:
+        response["relevant_laws"] = [snippet_law(law, question) for law in response["relevant_laws"]]
+    return response
+
+def lookup_related(section_nums, limit=RELATED_LIMIT):
+    """Sections each of section_nums cites and is cited by, from the legal_citations graph
+
+    One query: a lateral join per section and direction, each an index
+    range scan capped at `limit` edges. Returns {section_num: {"Cites": [...],
+    "CitedBy": [...]}} with sections we have not crawled left out.
+    """
+    related = {num: {"Cites": [], "CitedBy": []} for num in section_nums}
+    if not related:
+        return related
+    
+    with span(QUERY_STAGE_SECONDS, "related"), get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT s.num, 'Cites', r.section, r.citation_link
+            FROM unnest(%s::text[]) AS s(num)
+            CROSS JOIN LATERAL (
+                SELECT target_num AS num FROM legal_citations
+                WHERE source_num = s.num ORDER BY target_num LIMIT %s
+            ) AS e
+            JOIN legal_records r ON r.section_num = e.num
+            UNION ALL
+            SELECT s.num, 'CitedBy', r.section, r.citation_link
+            FROM unnest(%s::text[]) AS s(num)
+            CROSS JOIN LATERAL (
+                SELECT source_num AS num FROM legal_citations
+                WHERE target_num = s.num ORDER BY source_num LIMIT %s
+            ) AS e
+            JOIN legal_records r ON r.section_num = e.num
+            ORDER BY 1, 2, 3
+        """, (list(related), limit, list(related), limit))
+        for num, direction, section, citation_link in cursor.fetchall():
+            related[num][direction].append({"Section": section, "Citation": citation_link})
+    
+    return related
+
+def related_responses(responses):
+    """Copies of /query responses with each law's cited and citing sections added"""
+    def laws(response):
+        return response.get("relevant_laws") or ([response["relevant_law"]] if "relevant_law" in response else [])
+    
+    section_nums = {parse_section_number(law["Section"])[2] for response in responses for law in laws(response)}
     try:
-        # Check for specific keywords that might indicate a different type of query
-        comparative_keywords = ["compare", "difference", "differ", "versus", "vs"]
+        related = lookup_related(sorted(num for num in section_nums if num))
+    except Exception as e:
+        # The answers stand on their own; send them without related sections
+        print(f"⚠️ related sections lookup failed: {e}")
+        return responses
+    empty = {"Cites": [], "CitedBy": []}
+    
+    def with_related(law):
+        return dict(law, **related.get(parse_section_number(law["Section"])[2], empty))
+    
+    results = []
+    for response in responses:
+        response = dict(response)
+        if "relevant_law" in response:
+            response["relevant_law"] = with_related(response["relevant_law"])
+        if "relevant_laws" in response:
+            response["relevant_laws"] = [with_related(law) for law in response["relevant_laws"]]
+        results.append(response)
+    return results
+
+def cached_answer(question, top_k=None):
+    """The /query response for a question, and "hit" or "miss" for the response cache"""
+    try:
+        # Repeat questions against an unchanged corpus are answered from cache
+        key = f"{current_corpus_version()}:{top_k}:{normalize_question(question)}"
+        response = query_response_cache.get(key)
+        if response is not None:
+            return response, "hit"
+        response = answer_question(question, top_k)
+        if "error" not in response:
+            query_response_cache.set(key, response)
+        return response, "miss"
+    except Exception as e:
+        return {"error": str(e), "query": question}, "miss"
+
+def record_query(response, cache, request_timings):
+    method = response_method(response)
+    QUERY_SECONDS.observe(request_timings.elapsed(), method=method, cache=cache)
+    QUERIES.inc(method=method, cache=cache)
+
+@app.get("/query")
+def query_law(question: str, top_k: int = Query(None, ge=1, le=MAX_TOP_K), timings: bool = False,
+              snippet: bool = False, related: bool = False):
+    with collect_timings() as request_timings:
+        response, cache = cached_answer(question, top_k)
+        # Copies, so related sections, snippets and the breakdown never end
+        # up in the response cache
+        if related:
+            response = related_responses([response])[0]
+    
+    record_query(response, cache, request_timings)
+    if snippet:
+        response = snippet_response(response, question)
+    if timings:
+        response = dict(response, timings=request_timings.as_dict())
+    return response
+
+@app.get("/query/stream")
+def query_stream(question: str, top_k: int = Query(None, ge=1, le=MAX_TOP_K), timings: bool = False,
+                 snippet: bool = False, related: bool = False,
+                 format: str = Query("ndjson", pattern="^(ndjson|sse)$")):
+    """/query as a stream of events, one per matched section
+
+    Each law is sent as a "hit" event ({"rank", "law"}) in rank order and
+    flushed on its own. A final "done" event carries the method (and
+    timings); a question with no hits sends one "message" or "error" event
+    with the /query body instead. format=ndjson sends one JSON object per
+    line with its event in "event"; format=sse sends Server-Sent Events.
+
+    Only the framing differs from /query: ranking is one fusion step, so
+    the whole answer (and any related lookup) is ready before the first
+    event, and the first byte arrives no sooner than with /query.
+    """
+    def events():
+        # The whole answer is computed in one step, so the timings context
+        # never spans a yield
+        with collect_timings() as request_timings:
+            response, cache = cached_answer(question, top_k)
+            if related:
+                response = related_responses([response])[0]
+        record_query(response, cache, request_timings)
         
-        # Handle comparative questions
-        if any(keyword in question.lower() for keyword in comparative_keywords):
-            # For comparative questions, we might need to return multiple results
-            keywords = re.findall(r'\b\w+\b', question.lower())
-            keywords = [k for k in keywords if len(k) > 3]  # Filter out short words
-            keyword_results = search_by_keywords(keywords[:3])  # Use top 3 keywords
+        laws = response.get("relevant_laws") or ([response["relevant_law"]] if "relevant_law" in response else [])
+        if not laws:
+            yield "error" if "error" in response else "message", response
+            return
+        for rank, law in enumerate(laws, start=1):
+            yield "hit", {"rank": rank, "law": snippet_law(law, question) if snippet else law}
+        done = {"method": response["method"], "count": len(laws)}
+        if timings:
+            done["timings"] = request_timings.as_dict()
+        yield "done", done
+    
+    if format == "sse":
+        body = (f"event: {event}\ndata: {json.dumps(data)}\n\n" for event, data in events())
+        return StreamingResponse(body, media_type="text/event-stream")
+    body = (json.dumps({"event": event, **data}) + "\n" for event, data in events())
+    return StreamingResponse(body, media_type="application/x-ndjson")
+
+class BatchQuery(BaseModel):
+    questions: List[str] = Field(..., max_length=QUERY_BATCH_MAX)
+    top_k: Optional[int] = Field(None, ge=1, le=MAX_TOP_K)
+    timings: bool = False
+    snippet: bool = False
+    related: bool = False
+
+@app.post("/query/batch")
+def query_batch(batch: BatchQuery):
+    """Answer many questions in a few round-trips; results are in input order
+
+    Each result is what /query returns for that question. Cached answers
+    are reused and repeated questions are answered once.
+    """
+    questions = batch.questions
+    with collect_timings() as request_timings:
+        responses = [None] * len(questions)
+        cached = [False] * len(questions)
+        try:
+            version = current_corpus_version()
+            keys = [f"{version}:{batch.top_k}:{normalize_question(question)}" for question in questions]
+            pending = {}
+            for i, key in enumerate(keys):
+                responses[i] = query_response_cache.get(key)
+                cached[i] = responses[i] is not None
+                if responses[i] is None:
+                    pending.setdefault(key, []).append(i)
             
-            if keyword_results:
-                response = {
-                    "relevant_laws": []
-                }
-                for result in keyword_results[:2]:  # Return top 2 results for comparison
-                    response["relevant_laws"].append({
-                        "Title": result[1],
-                        "Chapter": result[2],
-                        "Section": result[3],
-                        "Text": result[4],
-                        "Citation": result[5]
-                    })
-                return response
-        
-        # Default case: direct or semantic search
-        search_result = get_related_law(question)
-        
-        if not search_result:
-            return {
-                "message": "No matching laws found",
-                "query": question
-            }
-        
-        if "error" in search_result:
-            return {"message": search_result["error"]}
-        
-        result = search_result.get("result")
-        
-        response = {
-            "relevant_law": {
-                "Title": result[1],
-                "Chapter": result[2],
-                "Section": result[3],
-                "Text": result[4],
-                "Citation": result[5]
-            }
-        }
-        
-        return response
+            answers = answer_questions([questions[indexes[0]] for indexes in pending.values()], batch.top_k)
+            for (key, indexes), response in zip(pending.items(), answers):
+                if "error" not in response:
+                    query_response_cache.set(key, response)
+                for i in indexes:
+                    responses[i] = response
+        except Exception as e:
+            responses = [
+                response if response is not None else {"error": str(e), "query": question}
+                for response, question in zip(responses, questions)
+            ]
+        if batch.related:
+            responses = related_responses(responses)
+    
+    for response, hit in zip(responses, cached):
+        QUERIES.inc(method=response_method(response), cache="hit" if hit else "miss")
+    QUERY_BATCH_SECONDS.observe(request_timings.elapsed())
+    QUERY_BATCH_SIZE.observe(len(questions))
+    if batch.snippet:
+        responses = [snippet_response(response, question) for response, question in zip(responses, questions)]
+    result = {"results": responses}
+    if batch.timings:
+        result["timings"] = request_timings.as_dict()
+    return result
+
+def response_method(response):
+    """Metrics label for a /query response: its method, "error" or "none"."""
+    return response.get("method") or ("error" if "error" in response else "none")
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache/stats")
+def cache_stats():
+    return {
+        "corpus_version": corpus_version["version"],
+        "response_cache": query_response_cache.stats(),
+        "embedding_cache": query_embedding_cache.stats()
+    }
+
+def is_comparative(question):
+    """Comparative questions return several results side by side"""
+    return any(keyword in question.lower() for keyword in COMPARATIVE_KEYWORDS)
+
+def question_top_k(question, top_k=None):
+    return top_k or (2 if is_comparative(question) else DEFAULT_TOP_K)
+
+def answer_question(question, top_k=None):
+    """Build the /query response for a question (uncached)"""
+    try:
+        # Direct lookup of every cited section, then hybrid search
+        search_result = get_related_law(question, question_top_k(question, top_k))
+        return format_answer(question, search_result, top_k)
     except Exception as e:
         return {"error": str(e), "query": question}
 
+def answer_questions(questions, top_k=None):
+    """answer_question for many questions, sharing lookups, embedding requests and searches"""
+    if not questions:
+        return []
+    try:
+        search_results = get_related_law_batch(questions, [question_top_k(question, top_k) for question in questions])
+    except Exception as e:
+        return [{"error": str(e), "query": question} for question in questions]
+    return [format_answer(question, search_result, top_k) for question, search_result in zip(questions, search_results)]
+
+def format_answer(question, search_result, top_k=None):
+    """The /query response for a question given its get_related_law result"""
+    if not search_result:
+        return {
+            "message": "No matching laws found",
+            "query": question
+        }
+    
+    if "error" in search_result:
+        return {"message": search_result["error"]}
+    
+    hits = search_result["results"]
+    if top_k or is_comparative(question) or len(hits) > 1:
+        return {
+            "relevant_laws": [format_law(hit) for hit in hits],
+            "method": search_result["method"]
+        }
+    
+    response = {
+        "relevant_law": format_law(hits[0]),
+        "method": search_result["method"]
+    }
+    
+    return response
+
 # Start the server with: uvicorn main:app --reload
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,179 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+# zstd compresses HTML better and faster than zlib; either can be read back
+# as long as the library that wrote a blob is installed
+try:
+    import zstandard
+    DEFAULT_CODEC = "zstd"
+except ImportError:
+    zstandard = None
+    DEFAULT_CODEC = "zlib"
+
+# Start a new pack file once the current one reaches this size
+PACK_MAX_BYTES = 1 << 30
+
+
+def compress(data, codec):
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return zlib.compress(data, 6)
+
+
+def decompress(data, codec):
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("page archive blob is zstd-compressed; pip install zstandard")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+class PageArchive:
+    """Content-addressed store of raw crawl responses.
+
+    Each distinct page body is compressed once and appended to a pack file
+    (pack-00001.pack, ...). index.sqlite maps its sha256 to the pack, offset
+    and length, and maps every URL to the digest it returned most recently,
+    so identical pages share one blob and a URL can be replayed without the
+    network.
+    """
+
+    def __init__(self, directory, codec=DEFAULT_CODEC, pack_max_bytes=PACK_MAX_BYTES):
+        self.directory = directory
+        self.codec = codec
+        self.pack_max_bytes = pack_max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.readers = {}
+        self.conn = sqlite3.connect(os.path.join(directory, "index.sqlite"), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                digest TEXT PRIMARY KEY,
+                pack TEXT NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                codec TEXT NOT NULL
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                digest TEXT NOT NULL REFERENCES blobs(digest),
+                content_type TEXT,
+                fetched_at REAL NOT NULL
+            )
+        """)
+        self.conn.commit()
+        packs = sorted(name for name in os.listdir(directory) if name.endswith(".pack"))
+        self.pack = packs[-1] if packs else "pack-00001.pack"
+
+    def put(self, url, content, content_type=None):
+        """Archive one response body for url. Returns its sha256 digest."""
+        digest = hashlib.sha256(content).hexdigest()
+        with self.lock:
+            known = self.conn.execute("SELECT 1 FROM blobs WHERE digest = ?", (digest,)).fetchone()
+            if not known:
+                self.append_blob(digest, content)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO pages (url, digest, content_type, fetched_at) VALUES (?, ?, ?, ?)",
+                (url, digest, content_type, time.time())
+            )
+            self.conn.commit()
+        return digest
+
+    def append_blob(self, digest, content):
+        """Append a compressed blob to the current pack; caller holds the lock."""
+        path = os.path.join(self.directory, self.pack)
+        if os.path.exists(path) and os.path.getsize(path) >= self.pack_max_bytes:
+            number = int(self.pack.split("-")[1].split(".")[0]) + 1
+            self.pack = f"pack-{number:05d}.pack"
+            path = os.path.join(self.directory, self.pack)
+        blob = compress(content, self.codec)
+        # The blob is on disk before the index points at it, so a crash
+        # leaves at most unreferenced bytes at the end of a pack
+        with open(path, "ab") as f:
+            offset = f.tell()
+            f.write(blob)
+        self.conn.execute(
+            "INSERT INTO blobs (digest, pack, offset, length, size, codec) VALUES (?, ?, ?, ?, ?, ?)",
+            (digest, self.pack, offset, len(blob), len(content), self.codec)
+        )
+
+    def get(self, url):
+        """Return the archived body for url, or None if it was never archived."""
+        with self.lock:
+            row = self.conn.execute("""
+                SELECT b.pack, b.offset, b.length, b.codec FROM pages p
+                JOIN blobs b ON b.digest = p.digest WHERE p.url = ?
+            """, (url,)).fetchone()
+        if row is None:
+            return None
+        return self.read_blob(*row)
+
+    def read_blob(self, pack, offset, length, codec):
+        with self.lock:
+            fd = self.readers.get(pack)
+            if fd is None:
+                fd = self.readers[pack] = os.open(os.path.join(self.directory, pack), os.O_RDONLY)
+        # pread needs no shared file position, so fetch threads read in parallel
+        return decompress(os.pread(fd, length, offset), codec)
+
+    def urls(self):
+        with self.lock:
+            return [url for url, in self.conn.execute("SELECT url FROM pages ORDER BY url")]
+
+    def stats(self):
+        with self.lock:
+            pages, = self.conn.execute("SELECT count(*) FROM pages").fetchone()
+            blobs, stored, raw = self.conn.execute(
+                "SELECT count(*), coalesce(sum(length), 0), coalesce(sum(size), 0) FROM blobs"
+            ).fetchone()
+        return {"pages": pages, "blobs": blobs, "raw_bytes": raw, "stored_bytes": stored,
+                "ratio": raw / stored if stored else 0.0}
+
+    def close(self):
+        with self.lock:
+            for fd in self.readers.values():
+                os.close(fd)
+            self.readers = {}
+            self.conn.close()
+
+
+def export_fixtures(archive, directory):
+    """Write every archived RCW page as <cite>.html (the benchmark fixture layout)."""
+    os.makedirs(directory, exist_ok=True)
+    written = 0
+    for url in archive.urls():
+        cite = url.lower().rpartition("cite=")[2].split("&")[0]
+        if not cite or cite == url.lower():
+            continue
+        with open(os.path.join(directory, f"{cite.upper()}.html"), "wb") as f:
+            f.write(archive.get(url))
+        written += 1
+    return written
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect or export a raw-HTML page archive.")
+    parser.add_argument("archive", help="archive directory written by scraper.py --archive")
+    parser.add_argument("--export", metavar="DIR", help="write pages as <cite>.html fixtures into DIR")
+    args = parser.parse_args()
+
+    archive = PageArchive(args.archive)
+    try:
+        stats = archive.stats()
+        print(f"{stats['pages']} pages in {stats['blobs']} blobs: {stats['raw_bytes'] / 1e6:.1f} MB raw, "
+              f"{stats['stored_bytes'] / 1e6:.1f} MB stored ({stats['ratio']:.1f}x)")
+        if args.export:
+            print(f"✅ Exported {export_fixtures(archive, args.export)} pages to {args.export}")
+    finally:
+        archive.close()
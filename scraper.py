@@ -1,11 +1,34 @@
 
+import argparse
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+import hashlib
+import multiprocessing
+import numpy as np
+import os
 import psycopg2
+from psycopg2.extras import execute_values
+import queue
+import threading
 import time
 import re
-from urllib.parse import urljoin, urlparse, parse_qs
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlencode, urljoin, urlparse, urlunparse, parse_qs, parse_qsl
 
+from cache import bump_corpus_version
+from citations import PART, cited_sections, parse_section_number
+from metrics import REGISTRY
+from page_archive import PageArchive
+
+# lxml builds trees several times faster than the pure-Python html.parser
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
 
 DB_CONFIG = {
     "dbname": "legal_db",
@@ -17,7 +40,11 @@ DB_CONFIG = {
 
 BASE_URL = "https://app.leg.wa.gov/rcw/"
 
+# Canonical address of every RCW title, chapter and section page
+RCW_PAGE_URL = "https://app.leg.wa.gov/RCW/default.aspx"
+
 
+# Fallback when the title list cannot be read from BASE_URL (see discover_titles)
 TITLE_URLS = {
          "1": "https://app.leg.wa.gov/rcw/default.aspx?Cite=1",
     "2": "https://app.leg.wa.gov/rcw/default.aspx?Cite=2",
@@ -29,13 +56,415 @@ HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/110.0.0.0 Safari/537.36"
 }
 
+# Crawl tuning: number of concurrent fetch workers and the per-host
+# token bucket (sustained requests per second and burst size)
+CRAWL_WORKERS = 8
+CRAWL_RATE = 5.0
+CRAWL_BURST = 5
+
+# pgvector settings: embedding width, ANN index type ("hnsw" or "ivfflat")
+# and its build parameters. Search-time ef_search/probes live in main.py.
+EMBEDDING_DIM = 1536
+VECTOR_INDEX_TYPE = "hnsw"
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 64
+IVFFLAT_LISTS = 100
+
+# Buffered writer tuning: rows per batch and max seconds between flushes
+DB_FLUSH_SIZE = 500
+DB_FLUSH_INTERVAL = 5.0
+
+# Staged crawl: parse processes (0 parses on the fetch threads instead),
+# pages allowed to wait between stages, and seconds between progress reports
+PARSE_WORKERS = os.cpu_count() or 1
+PIPELINE_BUFFER = 64
+PIPELINE_REPORT_INTERVAL = 30.0
+
+# Durable crawl frontier: max seconds of progress buffered before it is
+# written, and fetch attempts per page before it is given up on
+FRONTIER_FLUSH_INTERVAL = 5.0
+FRONTIER_MAX_ATTEMPTS = 3
+
+# Crawl metrics, written in the Prometheus textfile format to METRICS_FILE
+# (--metrics-file) after every database batch and when the crawl ends
+CRAWL_REQUESTS = REGISTRY.counter("rcw_crawl_requests_total", "Page requests by outcome", ["outcome"])
+CRAWL_BYTES = REGISTRY.counter("rcw_crawl_bytes_total", "Response bytes fetched")
+CRAWL_FETCH_SECONDS = REGISTRY.histogram("rcw_crawl_fetch_seconds", "HTTP latency per request attempt")
+CRAWL_ROWS = REGISTRY.counter("rcw_crawl_rows_written_total", "Section rows written to legal_records")
+CRAWL_ROWS_RATE = REGISTRY.gauge("rcw_crawl_rows_per_second", "Section rows written per second in this crawl")
+CRAWL_WRITE_SECONDS = REGISTRY.histogram("rcw_crawl_write_batch_seconds", "Time to upsert and commit one batch")
+CRAWL_STAGE_PAGES = REGISTRY.counter("rcw_crawl_stage_pages_total", "Pages through each pipeline stage", ["stage"])
+CRAWL_STAGE_RATE = REGISTRY.gauge(
+    "rcw_crawl_stage_pages_per_second", "Pages per second through each pipeline stage", ["stage"]
+)
+
+# Parse only the tags each page type needs: title and chapter pages are
+# scanned for links, section text lives in nested <div>s. Head, scripts and
+# other markup outside them are never built into the tree.
+STRAIN_HTML = True
+LINK_TAGS = SoupStrainer(["a", "title"])
+CONTENT_TAGS = SoupStrainer("div")
+
+TEXT_INDENT_STYLE = re.compile(r"text-indent")
+
+# RCW numbers in page links; titles and chapters can carry a letter, as in
+# cite=28A, cite=43.21C or cite=9A.04.010
+TITLE_CITE_PATTERN = re.compile(rf"cite=({PART})(?:&|$)", re.IGNORECASE)
+CHAPTER_CITE_PATTERN = re.compile(rf"cite=({PART}\.{PART})", re.IGNORECASE)
+SECTION_CITE_PATTERN = re.compile(rf"cite=({PART}\.{PART}\.{PART})", re.IGNORECASE)
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at `rate` tokens per second."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available, then consume it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+
+class HostRateLimiter:
+    """Keep one token bucket per host so politeness is enforced per server."""
+
+    def __init__(self, rate=CRAWL_RATE, capacity=CRAWL_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def wait(self, url):
+        host = urlparse(url).netloc.lower()
+        with self.lock:
+            bucket = self.buckets.get(host)
+            if bucket is None:
+                bucket = self.buckets[host] = TokenBucket(self.rate, self.capacity)
+        bucket.acquire()
+
+
+def create_session(pool_size=CRAWL_WORKERS):
+    """Create a keep-alive HTTP session shared by all crawl workers."""
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+SESSION = create_session()
+RATE_LIMITER = HostRateLimiter()
+
+# Set by scrape_laws(incremental=True); enables conditional GETs and hash checks
+CRAWL_CACHE = None
+
+# Set by scrape_laws(archive=...): raw responses are kept in PAGE_ARCHIVE, and
+# with REPLAY pages are read back from it instead of the network
+PAGE_ARCHIVE = None
+REPLAY = False
+METRICS_FILE = None
+
+
+def normalize_text(text):
+    """Collapse whitespace so cosmetic markup changes don't count as edits."""
+    return " ".join(text.split())
+
+
+def hash_text(text):
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class CrawlCache:
+    """HTTP validators per URL and content hashes per section from the last crawl."""
+
+    def __init__(self, validators=None, section_hashes=None):
+        self.validators = validators or {}
+        self.section_hashes = section_hashes or {}
+        self.dirty = set()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls):
+        conn = psycopg2.connect(**DB_CONFIG)
+        cursor = conn.cursor()
+        cursor.execute("SELECT url, etag, last_modified FROM crawl_cache")
+        validators = {url: (etag, last_modified) for url, etag, last_modified in cursor.fetchall()}
+        cursor.execute("SELECT section, content_hash FROM legal_records WHERE content_hash IS NOT NULL")
+        section_hashes = dict(cursor.fetchall())
+        conn.close()
+        print(f"Loaded crawl cache: {len(validators)} URLs, {len(section_hashes)} section hashes")
+        return cls(validators, section_hashes)
+
+    def conditional_headers(self, url):
+        etag, last_modified = self.validators.get(url, (None, None))
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        return headers
+
+    def record_validators(self, url, etag, last_modified):
+        if not etag and not last_modified:
+            return
+        with self.lock:
+            self.validators[url] = (etag, last_modified)
+            self.dirty.add(url)
+
+    def is_unchanged(self, section_id, content_hash):
+        return self.section_hashes.get(section_id) == content_hash
+
+    def save(self):
+        """Persist validators recorded during this crawl."""
+        with self.lock:
+            rows = [(url, *self.validators[url]) for url in self.dirty]
+            self.dirty = set()
+        if not rows:
+            return
+        conn = psycopg2.connect(**DB_CONFIG)
+        with conn.cursor() as cursor:
+            execute_values(cursor, """
+                INSERT INTO crawl_cache (url, etag, last_modified) VALUES %s
+                ON CONFLICT (url) DO UPDATE
+                SET etag = EXCLUDED.etag, last_modified = EXCLUDED.last_modified, updated_at = now()
+            """, rows)
+        conn.commit()
+        conn.close()
+        print(f"Saved validators for {len(rows)} URLs")
+
+
+def write_metrics():
+    """Write the crawl metrics to METRICS_FILE, if one is set."""
+    if METRICS_FILE:
+        REGISTRY.write_textfile(METRICS_FILE)
+
+def page_context(stage, title_num, chapter_name, section_id):
+    """Context tuple of a frontier page: what its parser and writer need."""
+    if stage == "title":
+        return (title_num,)
+    if stage == "chapter":
+        return (title_num, chapter_name)
+    return (title_num, chapter_name, section_id)
+
+
+class CrawlFrontier:
+    """Durable record of every page in the current crawl and how far it got.
+
+    Pages move pending -> fetched -> parsed -> stored, or to failed with
+    the error. Title and chapter pages are stored once the links they hold
+    are recorded, sections once SectionWriter has committed them. Changes
+    are buffered and written in one transaction per flush(), so a crash
+    loses at most FRONTIER_FLUSH_INTERVAL seconds of progress: the next run
+    fetches every page that was not yet stored and skips the rest. A
+    SeenSet of every URL in the crawl keeps pages from being queued twice.
+    """
+
+    UNFINISHED = ("pending", "fetched", "parsed")
+
+    def __init__(self, crawl_key="", max_attempts=FRONTIER_MAX_ATTEMPTS, flush_interval=FRONTIER_FLUSH_INTERVAL):
+        self.crawl_key = crawl_key
+        self.max_attempts = max_attempts
+        self.flush_interval = flush_interval
+        self.conn = psycopg2.connect(**DB_CONFIG)
+        self.seen = SeenSet()
+        self.resuming = False
+        self.unfinished = []
+        self.new_rows = []
+        self.updates = {}
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+
+    def load(self, restart=False):
+        """Resume an unfinished crawl, or clear the frontier for a new one.
+
+        A crawl is unfinished while any page is pending, fetched, parsed or
+        failed with attempts left. Pages to fetch again are left in
+        `unfinished` as (stage, url, context). Returns self.
+        """
+        with self.conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT count(*) FROM crawl_frontier
+                WHERE crawl_key = %s
+                  AND (state IN ('pending', 'fetched', 'parsed') OR (state = 'failed' AND attempts < %s))
+            """, (self.crawl_key, self.max_attempts))
+            if restart or not cursor.fetchone()[0]:
+                cursor.execute("DELETE FROM crawl_frontier WHERE crawl_key = %s", (self.crawl_key,))
+                self.conn.commit()
+                return self
+            cursor.execute("""
+                SELECT stage, url, title_num, chapter_name, section_id, state FROM crawl_frontier
+                WHERE crawl_key = %s ORDER BY id
+            """, (self.crawl_key,))
+            rows = cursor.fetchall()
+        self.conn.commit()
+        
+        self.seen = SeenSet(url for _, url, _, _, _, _ in rows)
+        self.resuming = True
+        self.unfinished = [
+            (stage, url, page_context(stage, title_num, chapter_name, section_id))
+            for stage, url, title_num, chapter_name, section_id, state in rows
+            if state in self.UNFINISHED
+        ]
+        print(f"🔁 Resuming crawl: {len(self.unfinished)} unfinished of {len(rows)} known pages")
+        return self
+
+    def add(self, stage, url, context):
+        """Record a newly discovered page. Returns False if the crawl already knows it."""
+        if not self.seen.add(url, stage):
+            return False
+        with self.lock:
+            self.new_rows.append((self.crawl_key, url, stage, *(tuple(context) + (None, None))[:3]))
+            return True
+
+    def mark(self, url, state, error=None, attempt=False):
+        """Move a page to `state`; `attempt` counts one more fetch of it."""
+        with self.lock:
+            attempts = self.updates[url][2] if url in self.updates else 0
+            self.updates[url] = (state, error, attempts + int(attempt))
+
+    def retry_failed(self):
+        """Requeue failed pages that have attempts left, as (stage, url, context)."""
+        self.flush()
+        with self.conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT stage, url, title_num, chapter_name, section_id FROM crawl_frontier
+                WHERE crawl_key = %s AND state = 'failed' AND attempts < %s ORDER BY id
+            """, (self.crawl_key, self.max_attempts))
+            rows = cursor.fetchall()
+        self.conn.commit()
+        for _, url, _, _, _ in rows:
+            self.mark(url, "pending")
+        return [(stage, url, page_context(stage, *context)) for stage, url, *context in rows]
+
+    def flush(self):
+        """Write buffered pages and state changes in one transaction."""
+        with self.lock:
+            new_rows, self.new_rows = self.new_rows, []
+            updates, self.updates = self.updates, {}
+        if new_rows or updates:
+            try:
+                with self.conn.cursor() as cursor:
+                    if new_rows:
+                        execute_values(cursor, """
+                            INSERT INTO crawl_frontier (crawl_key, url, stage, title_num, chapter_name, section_id)
+                            VALUES %s ON CONFLICT (crawl_key, url) DO NOTHING
+                        """, new_rows)
+                    if updates:
+                        execute_values(cursor, """
+                            UPDATE crawl_frontier AS f SET
+                                state = v.state, last_error = v.error,
+                                attempts = f.attempts + v.attempts, updated_at = now()
+                            FROM (VALUES %s) AS v(crawl_key, url, state, error, attempts)
+                            WHERE f.crawl_key = v.crawl_key AND f.url = v.url
+                        """, [(self.crawl_key, url, *update) for url, update in updates.items()])
+                self.conn.commit()
+            except psycopg2.Error:
+                self.conn.rollback()
+                raise
+        self.last_flush = time.monotonic()
+
+    def maybe_flush(self):
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def counts(self):
+        """Pages per state, as last flushed."""
+        counts = dict.fromkeys(self.UNFINISHED + ("stored", "failed"), 0)
+        with self.conn.cursor() as cursor:
+            cursor.execute("SELECT state, count(*) FROM crawl_frontier WHERE crawl_key = %s GROUP BY state",
+                           (self.crawl_key,))
+            counts.update(cursor.fetchall())
+        self.conn.commit()
+        return counts
+
+    def close(self):
+        try:
+            self.flush()
+            counts = self.counts()
+            print("🧭 Frontier: " + ", ".join(f"{count} {state}" for state, count in counts.items()))
+            self.seen.report()
+        finally:
+            self.conn.close()
+
+
+def migrate_embedding_column(conn, table, batch_size=1000, keep_values=True):
+    """Convert a legacy BYTEA embedding column (raw float32 bytes) to vector.
+
+    Without keep_values the old vectors are dropped rather than decoded.
+    """
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT data_type FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s AND column_name = 'embedding'
+    ''', (table,))
+    row = cursor.fetchone()
+    if not row or row[0] != 'bytea':
+        return
+    
+    print(f"🔄 Converting {table}.embedding from BYTEA to vector({EMBEDDING_DIM})...")
+    cursor.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS embedding_vector vector({EMBEDDING_DIM});")
+    converted = 0
+    while keep_values:
+        cursor.execute(f'''
+            SELECT id, embedding FROM {table}
+            WHERE embedding IS NOT NULL AND embedding_vector IS NULL
+            LIMIT %s
+        ''', (batch_size,))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        values = [(row_id, str(np.frombuffer(data, dtype=np.float32).tolist())) for row_id, data in rows]
+        execute_values(cursor, f'''
+            UPDATE {table} AS t SET embedding_vector = v.embedding::vector
+            FROM (VALUES %s) AS v(id, embedding)
+            WHERE t.id = v.id
+        ''', values)
+        conn.commit()
+        converted += len(rows)
+    
+    cursor.execute(f"ALTER TABLE {table} DROP COLUMN embedding;")
+    cursor.execute(f"ALTER TABLE {table} RENAME COLUMN embedding_vector TO embedding;")
+    conn.commit()
+    if keep_values:
+        print(f"✅ Converted {converted} embeddings in {table}")
+    else:
+        print(f"✅ Dropped legacy embeddings in {table}; they are re-embedded on the next run")
+
+def create_vector_index(cursor, table):
+    """Create the ANN index used by `embedding <-> query` searches."""
+    if VECTOR_INDEX_TYPE == "ivfflat":
+        cursor.execute(f'''
+            CREATE INDEX IF NOT EXISTS {table}_embedding_ivfflat ON {table}
+            USING ivfflat (embedding vector_l2_ops) WITH (lists = {int(IVFFLAT_LISTS)});
+        ''')
+    else:
+        cursor.execute(f'''
+            CREATE INDEX IF NOT EXISTS {table}_embedding_hnsw ON {table}
+            USING hnsw (embedding vector_l2_ops) WITH (m = {int(HNSW_M)}, ef_construction = {int(HNSW_EF_CONSTRUCTION)});
+        ''')
 
 def create_db():
     """Create the PostgreSQL database schema."""
     conn = psycopg2.connect(**DB_CONFIG)
     cursor = conn.cursor()
     
-    cursor.execute('''
+    cursor.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+    
+    cursor.execute(f'''
         CREATE TABLE IF NOT EXISTS legal_records (
             id SERIAL PRIMARY KEY,
             title TEXT NOT NULL,
@@ -43,86 +472,526 @@ def create_db():
             section TEXT NOT NULL,
             legal_text TEXT NOT NULL,
             citation_link TEXT NOT NULL,
-            embedding BYTEA  
+            embedding vector({EMBEDDING_DIM})
+        );
+    ''')
+    
+    # Incremental crawls upsert on section, so drop older duplicates first
+    cursor.execute("ALTER TABLE legal_records ADD COLUMN IF NOT EXISTS content_hash TEXT;")
+    cursor.execute('''
+        DELETE FROM legal_records a USING legal_records b
+        WHERE a.section = b.section AND a.id < b.id;
+    ''')
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS legal_records_section_key ON legal_records (section);")
+    
+    # Normalized citation numbers (e.g. 28A / 28A.150 / 28A.150.010) for
+    # exact, indexed lookups; rows from before these columns are backfilled
+    cursor.execute('''
+        ALTER TABLE legal_records
+            ADD COLUMN IF NOT EXISTS title_num TEXT,
+            ADD COLUMN IF NOT EXISTS chapter_num TEXT,
+            ADD COLUMN IF NOT EXISTS section_num TEXT;
+    ''')
+    cursor.execute('''
+        UPDATE legal_records SET
+            title_num = substring(upper(section) from '^([0-9]+[A-Z]?)[.][0-9]+[A-Z]?[.][0-9]+[A-Z]?$'),
+            chapter_num = substring(upper(section) from '^([0-9]+[A-Z]?[.][0-9]+[A-Z]?)[.][0-9]+[A-Z]?$'),
+            section_num = substring(upper(section) from '^([0-9]+[A-Z]?[.][0-9]+[A-Z]?[.][0-9]+[A-Z]?)$')
+        WHERE section_num IS NULL;
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS legal_records_title_num ON legal_records (title_num, chapter_num, section_num);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS legal_records_chapter_num ON legal_records (chapter_num, section_num);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS legal_records_section_num ON legal_records (section_num);")
+    
+    # Stemmed, stopword-free full-text vector kept in step with legal_text
+    cursor.execute('''
+        ALTER TABLE legal_records ADD COLUMN IF NOT EXISTS search_vector tsvector
+            GENERATED ALWAYS AS (to_tsvector('english', legal_text)) STORED;
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS legal_records_search_vector ON legal_records USING gin (search_vector);")
+    
+    # Token-bounded pieces of each section, embedded and searched individually
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS legal_chunks (
+            id SERIAL PRIMARY KEY,
+            record_id INTEGER NOT NULL REFERENCES legal_records(id) ON DELETE CASCADE,
+            chunk_index INTEGER NOT NULL,
+            chunk_text TEXT NOT NULL,
+            token_count INTEGER NOT NULL,
+            source_hash TEXT NOT NULL,
+            embedding vector({EMBEDDING_DIM}),
+            UNIQUE (record_id, chunk_index)
+        );
+    ''')
+    
+    # Single-row counter bumped whenever legal_records or its embeddings
+    # change; the API keys its response cache on it
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS corpus_version (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            version BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+    ''')
+    cursor.execute("INSERT INTO corpus_version DEFAULT VALUES ON CONFLICT DO NOTHING;")
+    
+    # Every page of the current crawl and how far it got (see CrawlFrontier)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS crawl_frontier (
+            id SERIAL PRIMARY KEY,
+            url TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            title_num TEXT,
+            chapter_name TEXT,
+            section_id TEXT,
+            state TEXT NOT NULL DEFAULT 'pending'
+                CHECK (state IN ('pending', 'fetched', 'parsed', 'stored', 'failed')),
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+    ''')
+    # One frontier per crawl slice (title selection and shard), so sharded
+    # crawlers can share the table; each slice fetches the title pages
+    cursor.execute("ALTER TABLE crawl_frontier ADD COLUMN IF NOT EXISTS crawl_key TEXT NOT NULL DEFAULT '';")
+    cursor.execute("ALTER TABLE crawl_frontier DROP CONSTRAINT IF EXISTS crawl_frontier_url_key;")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS crawl_frontier_crawl_url ON crawl_frontier (crawl_key, url);")
+    cursor.execute("DROP INDEX IF EXISTS crawl_frontier_state;")
+    cursor.execute("CREATE INDEX IF NOT EXISTS crawl_frontier_crawl_state ON crawl_frontier (crawl_key, state, attempts);")
+    
+    # Cross-references between sections, extracted from section text at
+    # ingest and keyed by section number (the cited section may not be
+    # crawled yet); the primary key serves "cites", the index "cited by"
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS legal_citations (
+            source_num TEXT NOT NULL,
+            target_num TEXT NOT NULL,
+            PRIMARY KEY (source_num, target_num)
+        );
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS legal_citations_target ON legal_citations (target_num, source_num);")
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS crawl_cache (
+            url TEXT PRIMARY KEY,
+            etag TEXT,
+            last_modified TEXT,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
         );
     ''')
     
+    conn.commit()
+    
+    # Older databases stored raw ndarray bytes; convert before indexing.
+    # Searches only read chunk vectors. Section vectors are rollups that no
+    # query reads, so they get no ANN index, and legacy ones are dropped:
+    # those sections have no chunks yet, so update_embeddings chunks them
+    # and rolls their vectors up again.
+    migrate_embedding_column(conn, "legal_records", keep_values=False)
+    cursor.execute("DROP INDEX IF EXISTS legal_records_embedding_hnsw;")
+    cursor.execute("DROP INDEX IF EXISTS legal_records_embedding_ivfflat;")
+    migrate_embedding_column(conn, "legal_chunks")
+    create_vector_index(cursor, "legal_chunks")
+    
     conn.commit()
     conn.close()
     print("Database initialized successfully.")
 
+# Upsert keyed on section. Rows whose text is unchanged are left alone, and a
+# changed text clears the embedding so update_embeddings picks it up again.
+UPSERT_CONFLICT_SQL = """
+    ON CONFLICT (section) DO UPDATE SET
+        title = EXCLUDED.title,
+        chapter = EXCLUDED.chapter,
+        legal_text = EXCLUDED.legal_text,
+        citation_link = EXCLUDED.citation_link,
+        content_hash = EXCLUDED.content_hash,
+        title_num = EXCLUDED.title_num,
+        chapter_num = EXCLUDED.chapter_num,
+        section_num = EXCLUDED.section_num,
+        embedding = CASE WHEN legal_records.legal_text = EXCLUDED.legal_text
+                         THEN legal_records.embedding END
+    WHERE legal_records.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+"""
+
 def save_to_db(title, chapter, section, text, link):
     """Save law records to SQLite database and print confirmation."""
     conn = psycopg2.connect(**DB_CONFIG)
     cursor = conn.cursor()
     
     cursor.execute(
-        "INSERT INTO legal_records (title, chapter, section, legal_text, citation_link) VALUES (%s, %s, %s, %s, %s)",
-        (title, chapter, section, text, link)
+        "INSERT INTO legal_records (title, chapter, section, legal_text, citation_link, content_hash, "
+        "title_num, chapter_num, section_num) "
+        "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)" + UPSERT_CONFLICT_SQL,
+        (title, chapter, section, text, link, hash_text(text), *parse_section_number(section))
     )
+    if cursor.rowcount:
+        bump_corpus_version(cursor)
 
     conn.commit()
     conn.close()
 
     print(f"✅ Inserted: {title} | {chapter} | {section} | {link}")
 
-def get_soup(url, retries=3):
-    """Make a request with retries and return a BeautifulSoup object."""
+class SectionWriter:
+    """Buffer scraped sections and insert them in batches over one connection.
+
+    A batch is flushed once `flush_size` rows are buffered or `flush_interval`
+    seconds have passed since the last flush; close() flushes what is left.
+    add() checks the interval as rows arrive, and crawl loops call
+    flush_if_due() while no sections come in.
+    Sections added with their cross-references have their legal_citations
+    edges replaced in the same transaction.
+    """
+
+    INSERT_SQL = (
+        "INSERT INTO legal_records (title, chapter, section, legal_text, citation_link, content_hash, "
+        "title_num, chapter_num, section_num) "
+        "VALUES %s" + UPSERT_CONFLICT_SQL
+    )
+
+    def __init__(self, flush_size=DB_FLUSH_SIZE, flush_interval=DB_FLUSH_INTERVAL, frontier=None):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.frontier = frontier
+        self.conn = psycopg2.connect(**DB_CONFIG)
+        self.buffer = []
+        self.references = {}
+        self.rows_written = 0
+        self.started = time.monotonic()
+        self.last_flush = self.started
+        self.failed = False
+
+    def add(self, title, chapter, section, text, link, content_hash=None, cross_references=None):
+        self.buffer.append((
+            title, chapter, section, text, link, content_hash or hash_text(text),
+            *parse_section_number(section)
+        ))
+        section_num = self.buffer[-1][-1]
+        if cross_references is not None and section_num:
+            self.references[section_num] = cross_references
+        if len(self.buffer) >= self.flush_size:
+            self.flush()
+        else:
+            self.flush_if_due()
+
+    def flush_if_due(self):
+        """Flush buffered rows once `flush_interval` seconds have passed since the last flush."""
+        if self.buffer and time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Insert all buffered rows in one statement and commit."""
+        if self.buffer:
+            # One statement cannot upsert the same section twice; keep the latest
+            rows = list({row[2]: row for row in self.buffer}.values())
+            start = time.perf_counter()
+            try:
+                with self.conn.cursor() as cursor:
+                    execute_values(cursor, self.INSERT_SQL, rows, page_size=len(rows))
+                    # Unchanged sections are skipped by the upsert and don't count
+                    if cursor.rowcount:
+                        bump_corpus_version(cursor)
+                    if self.references:
+                        replace_citation_edges(cursor, self.references)
+                self.conn.commit()
+            except psycopg2.Error:
+                # Keep the buffer so the final flush can retry it
+                self.failed = True
+                self.conn.rollback()
+                raise
+            self.failed = False
+            # Sections count as stored in the crawl frontier once committed
+            if self.frontier is not None:
+                for row in self.buffer:
+                    self.frontier.mark(row[4], "stored")
+            self.rows_written += len(self.buffer)
+            CRAWL_WRITE_SECONDS.observe(time.perf_counter() - start)
+            CRAWL_ROWS.inc(len(self.buffer))
+            CRAWL_ROWS_RATE.set(self.rows_written / (time.monotonic() - self.started or 1e-9))
+            write_metrics()
+            print(f"✅ Inserted batch of {len(self.buffer)} sections ({self.rows_written} total)")
+            self.buffer = []
+            self.references = {}
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # A failed flush would only fail again and mask the original error
+        if self.failed and exc_type is not None and issubclass(exc_type, psycopg2.Error):
+            self.conn.close()
+        else:
+            self.close()
+
+def replace_citation_edges(cursor, references):
+    """Replace the legal_citations edges of each {section number: cited section numbers}."""
+    cursor.execute("DELETE FROM legal_citations WHERE source_num = ANY(%s)", (list(references),))
+    edges = [(source, target) for source, targets in references.items() for target in targets]
+    if edges:
+        execute_values(cursor, "INSERT INTO legal_citations (source_num, target_num) VALUES %s ON CONFLICT DO NOTHING",
+                       edges, page_size=len(edges))
+
+def rebuild_citation_graph(batch_size=5000):
+    """Re-extract legal_citations from the stored text of every section.
+
+    For databases crawled before cross-references were kept, or after a
+    change to citation parsing; a crawl keeps the edges current otherwise.
+    """
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        read_cursor = conn.cursor(name="citation_graph")
+        read_cursor.itersize = batch_size
+        read_cursor.execute("SELECT section_num, legal_text FROM legal_records WHERE section_num IS NOT NULL")
+        references = {}
+        for section_num, text in read_cursor:
+            references[section_num] = cited_sections(text, section_num)
+        read_cursor.close()
+        
+        with conn.cursor() as cursor:
+            cursor.execute("TRUNCATE legal_citations")
+            replace_citation_edges(cursor, references)
+        conn.commit()
+    finally:
+        conn.close()
+    edges = sum(len(targets) for targets in references.values())
+    print(f"✅ Rebuilt citation graph: {edges} cross-references from {len(references)} sections")
+
+class FetchError(Exception):
+    """A page could not be fetched within its retries."""
+
+def fetch_page(url, retries=3, conditional=False, raise_errors=False):
+    """Make a request with retries and return the raw response bytes.
+
+    With `conditional` and an active CRAWL_CACHE, the request carries the
+    stored ETag/Last-Modified and a 304 response returns None. Skipped
+    pages also return None; a page that still fails after `retries` returns
+    None too, or raises FetchError with `raise_errors`. Pages are archived
+    in PAGE_ARCHIVE when it is set, and served from it under REPLAY.
+    """
     # Check if the URL is for a PDF
     parsed_url = urlparse(url)
     query_params = parse_qs(parsed_url.query)
     if 'pdf' in query_params and query_params['pdf'][0].lower() == 'true':
         print(f"⚠️ Skipping PDF URL: {url}")
+        CRAWL_REQUESTS.inc(outcome="skipped")
         return None
     
+    if REPLAY:
+        content = PAGE_ARCHIVE.get(canonical_url(url))
+        CRAWL_REQUESTS.inc(outcome="replayed" if content is not None else "missing")
+        if content is None:
+            print(f"⚠️ Not in archive: {url}")
+            if raise_errors:
+                raise FetchError(f"not in archive: {url}")
+        return content
+    
+    cache = CRAWL_CACHE if conditional else None
+    request_headers = cache.conditional_headers(url) if cache else {}
+    
     for attempt in range(retries):
         try:
+            RATE_LIMITER.wait(url)
             print(f"Requesting: {url}")
-            res = requests.get(url, headers=HEADERS, timeout=30)
+            with CRAWL_FETCH_SECONDS.time():
+                res = SESSION.get(url, headers=request_headers, timeout=30)
+            if res.status_code == 304:
+                print(f"⏭️ Not modified: {url}")
+                CRAWL_REQUESTS.inc(outcome="not_modified")
+                return None
             res.raise_for_status()
             
+            if cache:
+                cache.record_validators(url, res.headers.get("ETag"), res.headers.get("Last-Modified"))
+            
             # Check content type
             content_type = res.headers.get('Content-Type', '').lower()
             if 'pdf' in content_type or 'application/octet-stream' in content_type:
                 print(f"⚠️ Skipping URL with PDF content: {url}")
+                CRAWL_REQUESTS.inc(outcome="skipped")
                 return None
-                
-            # Try to parse as HTML
-            try:
-                return BeautifulSoup(res.text, "html.parser")
-            except Exception as parse_error:
-                print(f"⚠️ Failed to parse HTML: {str(parse_error)}")
-                return None
+            
+            CRAWL_REQUESTS.inc(outcome="fetched")
+            CRAWL_BYTES.inc(len(res.content))
+            if PAGE_ARCHIVE is not None:
+                PAGE_ARCHIVE.put(canonical_url(url), res.content, content_type)
+            return res.content
                 
         except (requests.RequestException, requests.ConnectionError) as e:
+            CRAWL_REQUESTS.inc(outcome="retried" if attempt < retries - 1 else "failed")
             if attempt < retries - 1:
                 wait_time = (attempt + 1) * 2  # Exponential backoff
                 print(f"⚠️ Attempt {attempt+1} failed for {url}. Retrying in {wait_time}s... Error: {str(e)}")
                 time.sleep(wait_time)
             else:
                 print(f"❌ ERROR: Failed to fetch {url} after {retries} attempts. Error: {str(e)}")
+                if raise_errors:
+                    raise FetchError(str(e)) from e
                 return None
 
-# def clean_url(url):
-#     """Clean URL by removing PDF parameter if present."""
-#     parsed_url = urlparse(url)
-#     query_params = parse_qs(parsed_url.query)
-    
-#     # Remove pdf parameter if present
-#     if 'pdf' in query_params:
-#         del query_params['pdf']
-    
-#     # Reconstruct the URL without the pdf parameter
-#     clean_params = "&".join([f"{k}={v[0]}" for k, v in query_params.items()])
-#     clean_url = f"{parsed_url.scheme}://{parsed_url.netloc}{parsed_url.path}"
-#     if clean_params:
-#         clean_url += f"?{clean_params}"
-    
-#     return clean_url
+def parse_html(content, parse_only=None):
+    """Parse raw page bytes, letting the parser detect the encoding once.
+
+    `parse_only` restricts the tree to matching tags (ignored when
+    STRAIN_HTML is off). Returns None for a missing page or a parse error.
+    """
+    if content is None:
+        return None
+    try:
+        return BeautifulSoup(content, HTML_PARSER, parse_only=parse_only if STRAIN_HTML else None)
+    except Exception as parse_error:
+        print(f"⚠️ Failed to parse HTML: {str(parse_error)}")
+        return None
+
+def get_soup(url, retries=3, conditional=False, parse_only=None):
+    """Fetch a page and return it as a BeautifulSoup object."""
+    return parse_html(fetch_page(url, retries, conditional), parse_only)
+
+def canonical_url(url):
+    """Normalize a crawl URL so every page has exactly one spelling.
+
+    Relative links are resolved against BASE_URL, the scheme and host are
+    lower-cased, and fragments and the pdf flag are dropped. Query
+    parameters are sorted. RCW pages become RCW_PAGE_URL?cite=<CITE>, with
+    the citation upper-cased: cite=28a.150 and Cite=28A.150 are one page.
+    """
+    parsed = urlparse(urljoin(BASE_URL, url.strip()))
+    params = [
+        (key.lower(), value) for key, value in parse_qsl(parsed.query, keep_blank_values=True)
+        if key.lower() != "pdf"
+    ]
+    netloc = parsed.netloc.lower()
+    if netloc == "app.leg.wa.gov" and parsed.path.lower() == "/rcw/default.aspx":
+        cite = dict(params).get("cite")
+        if cite:
+            others = sorted((key, value) for key, value in params if key != "cite")
+            return f"{RCW_PAGE_URL}?{urlencode([('cite', cite.upper())] + others)}"
+    return urlunparse((parsed.scheme.lower(), netloc, parsed.path or "/", "", urlencode(sorted(params)), ""))
+
+def url_fingerprint(url):
+    """64-bit blake2b hash of a canonical URL."""
+    return int.from_bytes(hashlib.blake2b(url.encode("utf-8"), digest_size=8).digest(), "little")
+
+class SeenSet:
+    """Crawl-wide set of visited URLs in 8 bytes each.
+
+    URLs are kept as 64-bit fingerprints; a false duplicate needs a hash
+    collision (about 1 in 10^8 at a million URLs). New fingerprints go into
+    a small Python set that is merged into a sorted NumPy array, searched by
+    bisection, every MERGE_SIZE additions. Links offered and rejected are
+    counted per stage so duplicate rates can be reported.
+    """
+
+    MERGE_SIZE = 4096
+
+    def __init__(self, urls=()):
+        self.sorted = np.unique(np.fromiter((url_fingerprint(url) for url in urls), dtype=np.uint64))
+        self.recent = set()
+        self.offered = {}
+        self.duplicates = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.sorted) + len(self.recent)
+
+    def add(self, url, stage="page"):
+        """Record a canonical URL. Returns False if it was already seen."""
+        fingerprint = url_fingerprint(url)
+        with self.lock:
+            self.offered[stage] = self.offered.get(stage, 0) + 1
+            index = np.searchsorted(self.sorted, np.uint64(fingerprint))
+            if fingerprint in self.recent or (index < len(self.sorted) and self.sorted[index] == fingerprint):
+                self.duplicates[stage] = self.duplicates.get(stage, 0) + 1
+                return False
+            self.recent.add(fingerprint)
+            if len(self.recent) >= self.MERGE_SIZE:
+                recent = np.fromiter(self.recent, dtype=np.uint64, count=len(self.recent))
+                self.sorted = np.union1d(self.sorted, recent)
+                self.recent = set()
+            return True
+
+    def report(self):
+        with self.lock:
+            for stage, offered in self.offered.items():
+                duplicates = self.duplicates.get(stage, 0)
+                print(f"🔗 {stage} links: {offered} found, {duplicates} duplicates skipped "
+                      f"({duplicates / offered:.1%})")
+
+def title_sort_key(title_num):
+    """Order titles as the code does: 28, 28A, 28B, 29."""
+    match = re.match(r"(\d+)([A-Z]?)$", title_num.strip().upper())
+    if not match:
+        raise ValueError(f"not an RCW title number: {title_num!r}")
+    return int(match.group(1)), match.group(2)
+
+def parse_title_links(content):
+    """Extract {title number: URL} from the raw bytes of the RCW root page, in code order."""
+    soup = parse_html(content, LINK_TAGS)
+    if not soup:
+        return {}
+    titles = {}
+    for link in soup.find_all('a', href=True):
+        url = canonical_url(link['href'])
+        match = TITLE_CITE_PATTERN.search(url)
+        if match and url.startswith(RCW_PAGE_URL):
+            titles.setdefault(match.group(1).upper(), url)
+    return dict(sorted(titles.items(), key=lambda item: title_sort_key(item[0])))
+
+def discover_titles(root_url=BASE_URL):
+    """Find every title linked from the RCW root page, falling back to TITLE_URLS."""
+    titles = parse_title_links(fetch_page(root_url))
+    if not titles:
+        print(f"⚠️ No titles found at {root_url}; falling back to TITLE_URLS")
+        return {title_num: canonical_url(url) for title_num, url in TITLE_URLS.items()}
+    print(f"Discovered {len(titles)} titles ({next(iter(titles))} to {list(titles)[-1]})")
+    return titles
+
+def select_titles(titles, spec):
+    """Keep the titles matched by a spec such as "1-3,28A,40-45"; ranges are inclusive."""
+    ranges = []
+    for part in spec.split(","):
+        low, _, high = part.strip().partition("-")
+        ranges.append((title_sort_key(low), title_sort_key(high or low)))
+    return {
+        title_num: url for title_num, url in titles.items()
+        if any(low <= title_sort_key(title_num) <= high for low, high in ranges)
+    }
+
+def parse_shard(spec):
+    """Parse "I/N" (0 <= I < N) into (I, N)."""
+    index, _, count = spec.partition("/")
+    shard = int(index), int(count)
+    if not 0 <= shard[0] < shard[1]:
+        raise ValueError(f"shard must be I/N with 0 <= I < N, got {spec!r}")
+    return shard
+
+def in_shard(chapter_url, shard):
+    """Whether a chapter belongs to shard (I, N).
+
+    Chapters rather than titles are split, since title sizes vary by orders
+    of magnitude. The hash is of the canonical URL, so every process and
+    machine assigns chapters the same way.
+    """
+    if shard is None:
+        return True
+    index, count = shard
+    return zlib.crc32(chapter_url.encode("utf-8")) % count == index
 
 def extract_chapter_links(title_url, title_num):
     """Extract chapter links from a title page."""
-    soup = get_soup(title_url)
+    return parse_chapter_links(fetch_page(title_url), title_num)
+
+def parse_chapter_links(content, title_num):
+    """Extract chapter links from the raw bytes of a title page."""
+    soup = parse_html(content, LINK_TAGS)
     if not soup:
         return []
     
@@ -131,6 +1000,8 @@ def extract_chapter_links(title_url, title_num):
     print(f"Page title: {page_title}")
     
     chapter_links = []
+    # Title pages often link a chapter more than once
+    chapter_urls = set()
     
     # Find all links in the main content area
     links = soup.find_all('a', href=True)
@@ -146,9 +1017,9 @@ def extract_chapter_links(title_url, title_num):
         
         # Look for links like "https://app.leg.wa.gov/RCW/default.aspx?cite=2.04"
         if 'rcw/default.aspx?cite=' in href or 'rcw/default.aspx?Cite=' in href:
-            cite_match = re.search(r'cite=(\d+\.\d+)', href, re.IGNORECASE)
+            cite_match = CHAPTER_CITE_PATTERN.search(href)
             if cite_match:
-                cite_value = cite_match.group(1)
+                cite_value = cite_match.group(1).upper()
                 title_part = cite_value.split('.')[0]
                 
                 # Make sure it's a chapter of the current title
@@ -157,11 +1028,11 @@ def extract_chapter_links(title_url, title_num):
                     if not text or not re.search(r'chapter|sections', text, re.IGNORECASE):
                         text = f"Chapter {cite_value}"
                     
-                    # Clean the URL (remove PDF parameter if present)
-                    # cleaned_url = clean_url(href)
-                    
                     # Normalize URL
-                    chapter_url = f"https://app.leg.wa.gov/RCW/default.aspx?cite={cite_value}"
+                    chapter_url = canonical_url(f"{RCW_PAGE_URL}?cite={cite_value}")
+                    if chapter_url in chapter_urls:
+                        continue
+                    chapter_urls.add(chapter_url)
                     chapter_links.append((text, chapter_url))
                     print(f"Found chapter link: {text} -> {chapter_url}")
     
@@ -175,22 +1046,19 @@ def extract_chapter_links(title_url, title_num):
             text = link.text.strip()
             
             # Look for links containing the title number and having a potential chapter format
-            if f"cite={title_num}." in href.lower() and re.search(r'\d+\.\d+', href):
-                # Clean the URL
-                if href.startswith('/'):
-                    full_url = "https://app.leg.wa.gov" + href
-                else:
-                    full_url = href
-                
-                # Remove PDF parameter if present
-                full_url = clean_url(full_url)
+            if f"cite={title_num.lower()}." in href and CHAPTER_CITE_PATTERN.search(href):
+                # Resolve relative links and drop the PDF parameter
+                full_url = canonical_url(href)
+                if full_url in chapter_urls:
+                    continue
+                chapter_urls.add(full_url)
                 
                 # If the text is empty or doesn't look like chapter name, create one
                 if not text:
                     # Extract chapter number from the URL
-                    chapter_match = re.search(r'cite=(\d+\.\d+)', href, re.IGNORECASE)
+                    chapter_match = CHAPTER_CITE_PATTERN.search(href)
                     if chapter_match:
-                        text = f"Chapter {chapter_match.group(1)}"
+                        text = f"Chapter {chapter_match.group(1).upper()}"
                     else:
                         text = f"Chapter {href.split('=')[-1]}"
                 
@@ -201,7 +1069,11 @@ def extract_chapter_links(title_url, title_num):
 
 def extract_section_links(chapter_url):
     """Extract section links from a chapter page with URL deduplication."""
-    soup = get_soup(chapter_url)
+    return parse_section_links(fetch_page(chapter_url), chapter_url)
+
+def parse_section_links(content, chapter_url):
+    """Extract section links from the raw bytes of a chapter page."""
+    soup = parse_html(content, LINK_TAGS)
     if not soup:
         return []
     
@@ -209,7 +1081,7 @@ def extract_section_links(chapter_url):
     unique_section_urls = {}
     
     # Extract title.chapter part from URL
-    chapter_match = re.search(r'cite=(\d+\.\d+)', chapter_url, re.IGNORECASE)
+    chapter_match = CHAPTER_CITE_PATTERN.search(chapter_url)
     if not chapter_match:
         print(f"⚠️ Could not extract chapter pattern from URL: {chapter_url}")
         return []
@@ -225,20 +1097,15 @@ def extract_section_links(chapter_url):
         section_pattern = f"{chapter_prefix}\.\d+"
         
         # Check URL for section pattern
-        if href and re.search(r'cite=\d+\.\d+\.\d+', href, re.IGNORECASE):
-            # Clean the URL (remove PDF parameter if present)
-            href = clean_url(href)
-            
-            # Fix the URL if it's a relative path
-            if href.startswith('/'):
-                full_url = "https://app.leg.wa.gov" + href
-            else:
-                full_url = href
+        if href and SECTION_CITE_PATTERN.search(href):
+            # Resolve relative links; case and parameter order variants of
+            # one section share a canonical URL
+            full_url = canonical_url(href)
             
             # Extract section ID from URL for consistent naming
-            section_match = re.search(r'cite=(\d+\.\d+\.\d+)', href, re.IGNORECASE)
+            section_match = SECTION_CITE_PATTERN.search(href)
             if section_match:
-                section_id = section_match.group(1)
+                section_id = section_match.group(1).upper()
                 
                 # Store only unique URLs with their proper section ID
                 if full_url not in unique_section_urls:
@@ -254,40 +1121,46 @@ def extract_section_links(chapter_url):
 
 def extract_section_content(section_url):
     """Extract the clean section content from a section page."""
-    # Clean the URL (remove PDF parameter if present)
-    section_url = clean_url(section_url)
-    
-    soup = get_soup(section_url)
+    section_url = canonical_url(section_url)
+    return parse_section_content(fetch_page(section_url, conditional=True), section_url)
+
+def parse_section_content(content, section_url):
+    """Extract the section number, title and text from the raw bytes of a section page."""
+    soup = parse_html(content, CONTENT_TAGS)
     if not soup:
         return None
     
     result = {}
     
-    # Try to find the RCW section number
+    # One pass over the headings finds both the RCW number (the heading
+    # link) and the section title (the first div heading without links)
     rcw_number = None
-    rcw_links = soup.select('h3 a.ui-link')
-    for link in rcw_links:
-        if 'RCW/default.aspx?cite=' in link.get('href', ''):
-            rcw_number = link.text.strip()
-            break
+    title_element = None
+    for heading in soup.find_all('h3'):
+        links = heading.find_all('a')
+        if not links:
+            if title_element is None and heading.find_parent('div'):
+                title_element = heading
+            continue
+        for link in links:
+            if rcw_number is None and 'ui-link' in link.get('class', []) and 'RCW/default.aspx?cite=' in link.get('href', ''):
+                rcw_number = link.text.strip()
     
     if not rcw_number:
         # Alternative approach - look for the cite in the URL
-        cite_match = re.search(r'cite=(\d+\.\d+\.\d+)', section_url, re.IGNORECASE)
+        cite_match = SECTION_CITE_PATTERN.search(section_url)
         if cite_match:
-            rcw_number = cite_match.group(1)
+            rcw_number = cite_match.group(1).upper()
     
     result['section_id'] = rcw_number
     
-    # Try to find the section title
-    title_element = soup.select_one('div h3:not(:has(a))')
     if title_element:
         result['title'] = title_element.text.strip()
     else:
         result['title'] = "Unknown Title"
     
     # Find the content divs - focusing on the main text content
-    content_divs = soup.select('div div[style*="text-indent"]')
+    content_divs = [div for div in soup.find_all('div', style=TEXT_INDENT_STYLE) if div.find_parent('div')]
     if content_divs:
         # Join all indented text sections
         content_text = ' '.join([div.get_text(strip=True) for div in content_divs])
@@ -322,23 +1195,118 @@ def extract_section_content(section_url):
     
     # Format the result to match your desired output
     formatted_text = f"RCW **{result['section_id']}**\n{result['title']}\n{result['text']}"
-    
-    print("=---------------------------------------------------------")
-    print(formatted_text)
-    print("=---------------------------------------------------------")
+    print(f"📄 Parsed RCW {result['section_id']}: {result['title']} ({len(result['text'])} chars)")
 
     return {
         'text': formatted_text,
-        'citation_links': []  # Skip citation links as they're not needed
+        # Sections this one cites, stored as legal_citations edges
+        'cross_references': cited_sections(result['text'], rcw_number)
     }
 
-def scrape_laws():
-    """Scrape Washington State Laws from Titles 1 to 3."""
+def save_section(writer, title_num, chapter_name, section_id, section_url, content):
+    """Queue a scraped section and its cross-references on the writer.
+
+    Returns False when the section is unchanged since the last crawl.
+    """
+    content_hash = hash_text(content['text'])
+    if CRAWL_CACHE and CRAWL_CACHE.is_unchanged(section_id, content_hash):
+        print(f"⏭️ Unchanged: {section_id}")
+        return False
+    
+    writer.add(
+        f"Title {title_num}", 
+        chapter_name, 
+        section_id, 
+        content['text'], 
+        section_url,
+        content_hash,
+        content['cross_references']
+    )
+    return True
+
+def scrape_laws(workers=CRAWL_WORKERS, flush_size=DB_FLUSH_SIZE, flush_interval=DB_FLUSH_INTERVAL,
+                incremental=False, parse_workers=PARSE_WORKERS, restart=False, archive=None, replay=False,
+                titles=None, shard=None, metrics_file=None):
+    """Scrape Washington State Laws for every title listed on the RCW root page.
+
+    `titles` limits the crawl to a spec such as "1-3,28A" and `shard`, an
+    (I, N) pair, to a deterministic 1/N of the chapters (see in_shard), so
+    N crawlers can split the code between them.
+
+    With `incremental`, section pages are fetched conditionally and only
+    sections whose normalized text changed are written. With more than one
+    worker, pages are parsed by `parse_workers` processes (see
+    scrape_laws_pipeline), or on the fetch threads when it is 0.
+
+    The pipeline records its progress in the crawl frontier and resumes an
+    interrupted crawl where it stopped; `restart` discards that progress.
+    The sequential (one worker) and threaded (no parse workers) crawls keep
+    no frontier: they always start over, and their SeenSet lives only in
+    memory.
+
+    `archive` is a PageArchive directory that keeps every raw response;
+    with `replay` the crawl reads pages from it and never hits the network.
+
+    `metrics_file` receives the crawl's Prometheus metrics (see write_metrics).
+    """
+    global CRAWL_CACHE, PAGE_ARCHIVE, REPLAY, METRICS_FILE
+    
     # Create database if it doesn't exist
     create_db()
+    CRAWL_CACHE = CrawlCache.load() if incremental and not replay else None
+    PAGE_ARCHIVE = PageArchive(archive) if archive else None
+    REPLAY = bool(replay and PAGE_ARCHIVE)
+    METRICS_FILE = metrics_file
+    use_pipeline = workers > 1 and parse_workers > 0
+    frontier = None
+    
+    try:
+        title_urls = discover_titles()
+        if titles:
+            title_urls = select_titles(title_urls, titles)
+        if not title_urls:
+            print(f"⚠️ No titles match {titles!r}")
+            return
+        print(f"Crawling {len(title_urls)} titles" + (f", chapter shard {shard[0]}/{shard[1]}" if shard else ""))
+        
+        if not use_pipeline:
+            print("⚠️ Only the pipeline (--workers above 1, --parse-workers above 0) records crawl "
+                  "progress; this crawl cannot be resumed and starts from the beginning")
+        if use_pipeline:
+            # A replay and an interrupted live crawl of the same titles keep
+            # separate progress
+            crawl_key = f"titles={titles or 'all'}"
+            if shard:
+                crawl_key += f" shard={shard[0]}/{shard[1]}"
+            crawl_key += f" replay={os.path.abspath(archive)}" if REPLAY else " live"
+            frontier = CrawlFrontier(crawl_key).load(restart)
+        # The writer's final flush runs on exit, including interrupts
+        with SectionWriter(flush_size, flush_interval, frontier) as writer:
+            if use_pipeline:
+                scrape_laws_pipeline(writer, frontier, workers, parse_workers, titles=title_urls, shard=shard)
+            elif workers > 1:
+                scrape_laws_concurrent(writer, workers, titles=title_urls, shard=shard)
+            else:
+                scrape_laws_sequential(writer, titles=title_urls, shard=shard)
+    finally:
+        # Written after the writer's last commit so stored sections stay stored
+        if frontier is not None:
+            frontier.close()
+        if PAGE_ARCHIVE is not None:
+            PAGE_ARCHIVE.close()
+            PAGE_ARCHIVE, REPLAY = None, False
+        write_metrics()
+        METRICS_FILE = None
     
+    # Validators are only saved once their sections are safely stored
+    if CRAWL_CACHE:
+        CRAWL_CACHE.save()
+
+def scrape_laws_sequential(writer, titles=None, shard=None):
+    """Crawl titles, chapters and sections one request at a time."""
+    seen = SeenSet()
     # Process each title directly using the correct URLs
-    for title_num, title_url in TITLE_URLS.items():
+    for title_num, title_url in (TITLE_URLS if titles is None else titles).items():
         print(f"\n🔍 Processing Title {title_num} ({title_url})")
         
         # Get chapter links
@@ -350,8 +1318,9 @@ def scrape_laws():
         print(f"Found {len(chapter_links)} chapters in Title {title_num}")
         
         for chapter_name, chapter_url in chapter_links:
+            if not in_shard(chapter_url, shard) or not seen.add(chapter_url, "chapter"):
+                continue
             print(f"\n📌 Processing {chapter_name} ({chapter_url})")
-            time.sleep(1)  # Be nice to the server
             
             # Get section links
             section_links = extract_section_links(chapter_url)
@@ -362,28 +1331,356 @@ def scrape_laws():
             print(f"Found {len(section_links)} sections in {chapter_name}")
             
             for section_id, section_url in section_links:
+                if not seen.add(section_url, "section"):
+                    continue
                 print(f"📝 Processing section {section_id} ({section_url})")
-                time.sleep(1)  # Be nice to the server
                 
                 # Get section content
                 content = extract_section_content(section_url)
                 if not content:
                     continue
                     
-                # Save the section to the database
-                save_to_db(
-                    f"Title {title_num}", 
-                    chapter_name, 
-                    section_id, 
-                    content['text'], 
-                    section_url
-                )
+                save_section(writer, title_num, chapter_name, section_id, section_url, content)
+            writer.flush_if_due()
+    seen.report()
+
+def scrape_laws_concurrent(writer, workers=CRAWL_WORKERS, titles=None, shard=None):
+    """Crawl titles, chapters and sections with a bounded pool of fetch workers.
+
+    Requests are throttled by RATE_LIMITER (per host) rather than fixed sleeps.
+    Database writes stay on the calling thread so inserts are serialized.
+    """
+    seen = SeenSet()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # Each future maps to (stage, context) so results can be routed
+        jobs = {}
+        for title_num, title_url in (TITLE_URLS if titles is None else titles).items():
+            print(f"\n🔍 Queueing Title {title_num} ({title_url})")
+            future = pool.submit(extract_chapter_links, title_url, title_num)
+            jobs[future] = ("title", (title_num, title_url))
+        
+        pending = set(jobs)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED, timeout=writer.flush_interval)
+            writer.flush_if_due()
+            for future in done:
+                stage, context = jobs.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"❌ ERROR: {stage} job failed for {context}: {str(e)}")
+                    continue
+                
+                if stage == "title":
+                    title_num, title_url = context
+                    if not result:
+                        print(f"⚠️ No chapters found in Title {title_num} at {title_url}")
+                        continue
+                    print(f"Found {len(result)} chapters in Title {title_num}")
+                    for chapter_name, chapter_url in result:
+                        if not in_shard(chapter_url, shard) or not seen.add(chapter_url, "chapter"):
+                            continue
+                        next_future = pool.submit(extract_section_links, chapter_url)
+                        jobs[next_future] = ("chapter", (title_num, chapter_name, chapter_url))
+                        pending.add(next_future)
+                
+                elif stage == "chapter":
+                    title_num, chapter_name, chapter_url = context
+                    if not result:
+                        print(f"⚠️ No sections found in {chapter_name} at {chapter_url}")
+                        continue
+                    print(f"Found {len(result)} sections in {chapter_name}")
+                    for section_id, section_url in result:
+                        if not seen.add(section_url, "section"):
+                            continue
+                        next_future = pool.submit(extract_section_content, section_url)
+                        jobs[next_future] = ("section", (title_num, chapter_name, section_id, section_url))
+                        pending.add(next_future)
+                
+                elif result:
+                    title_num, chapter_name, section_id, section_url = context
+                    save_section(writer, title_num, chapter_name, section_id, section_url, result)
+    seen.report()
+
+def fetch_stage(stage, url):
+    """Fetch-thread task: a page's raw bytes and the seconds spent getting them.
+
+    Raises FetchError when the page cannot be fetched.
+    """
+    start = time.perf_counter()
+    if stage == "section":
+        content = fetch_page(canonical_url(url), conditional=True, raise_errors=True)
+    else:
+        content = fetch_page(url, raise_errors=True)
+    return content, time.perf_counter() - start
+
+def parse_stage(stage, content, url, title_num):
+    """Parse-process task: run the page's parser over its raw bytes."""
+    start = time.perf_counter()
+    if stage == "title":
+        result = parse_chapter_links(content, title_num)
+    elif stage == "chapter":
+        result = parse_section_links(content, url)
+    else:
+        result = parse_section_content(content, canonical_url(url))
+    return result, time.perf_counter() - start
+
+class PipelineStats:
+    """Per-stage throughput counters for scrape_laws_pipeline."""
+
+    STAGES = ("fetch", "parse", "write")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.items = dict.fromkeys(self.STAGES, 0)
+        self.busy = dict.fromkeys(self.STAGES, 0.0)
+        self.max_queued = dict.fromkeys(self.STAGES, 0)
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def record(self, stage, seconds, size=0):
+        with self.lock:
+            self.items[stage] += 1
+            self.busy[stage] += seconds
+            self.bytes += size
+        CRAWL_STAGE_PAGES.inc(stage=stage)
+
+    def queued(self, stage, depth):
+        with self.lock:
+            self.max_queued[stage] = max(self.max_queued[stage], depth)
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started or 1e-9
+        with self.lock:
+            print(f"📊 Pipeline after {elapsed:.0f}s ({self.bytes / elapsed / 1e6:.2f} MB/sec fetched):")
+            for stage in self.STAGES:
+                items = self.items[stage]
+                CRAWL_STAGE_RATE.set(items / elapsed, stage=stage)
+                per_item = self.busy[stage] / items * 1000 if items else 0.0
+                print(f"   {stage:<6} {items:>8} pages  {items / elapsed:8.1f}/sec  "
+                      f"{per_item:8.1f}ms/page  max queued {self.max_queued[stage]}")
+
+class WriterStage(threading.Thread):
+    """Thread that persists parsed sections through a SectionWriter.
+
+    Sections arrive on a bounded queue, so a slow database stalls the
+    parse stage instead of piling results up in memory. Unchanged sections
+    never reach the writer, so they are marked stored in the frontier here.
+    """
+
+    def __init__(self, writer, stats, max_queued=PIPELINE_BUFFER, frontier=None):
+        super().__init__(name="section-writer", daemon=True)
+        self.writer = writer
+        self.stats = stats
+        self.frontier = frontier
+        self.queue = queue.Queue(maxsize=max_queued)
+        self.error = None
+
+    def run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=self.writer.flush_interval)
+            except queue.Empty:
+                # Commit a partial batch rather than hold it until the next section
+                try:
+                    self.writer.flush_if_due()
+                except Exception as e:
+                    self.error = e
+                    return
+                continue
+            if item is None:
+                return
+            start = time.perf_counter()
+            try:
+                queued = save_section(self.writer, *item)
+            except Exception as e:
+                # Surface the failure to the crawl loop on its next submit
+                self.error = e
+                return
+            if not queued and self.frontier is not None:
+                self.frontier.mark(item[3], "stored")
+            self.stats.record("write", time.perf_counter() - start)
+
+    def submit(self, *item):
+        """Queue one save_section call, blocking while the queue is full."""
+        while True:
+            if self.error:
+                raise self.error
+            try:
+                self.queue.put(item, timeout=1)
+                break
+            except queue.Full:
+                continue
+        self.stats.queued("write", self.queue.qsize())
+
+    def close(self):
+        """Wait for queued sections to be handed to the writer."""
+        if self.is_alive():
+            self.queue.put(None)
+            self.join()
+        if self.error:
+            raise self.error
+
+def scrape_laws_pipeline(writer, frontier, workers=CRAWL_WORKERS, parse_workers=PARSE_WORKERS,
+                         buffer_size=PIPELINE_BUFFER, titles=None, shard=None):
+    """Crawl with separate fetch, parse and write stages.
+
+    Fetch threads download raw pages (throttled by RATE_LIMITER), a process
+    pool parses them on every core, and a WriterStage thread persists the
+    sections. Each hand-off is bounded: no new fetches start while
+    `buffer_size` pages wait for a parser, at most two pages per parse
+    process are in flight, and parsed sections wait on the writer's queue.
+    Section pages are fetched before chapter and title pages, so the
+    crawl finishes chapters before opening new ones.
+
+    Every page goes through the loaded CrawlFrontier: a resumed crawl starts
+    from its unfinished pages, links it already knows are not queued again,
+    and failed pages are retried in further passes until they succeed or
+    run out of attempts.
+    """
+    stats = PipelineStats()
+    # Pages to fetch per stage as (stage, url, context); context starts with title_num
+    to_fetch = {stage: deque() for stage in ("title", "chapter", "section")}
+    
+    def enqueue(stage, url, context):
+        url = canonical_url(url)
+        if frontier.add(stage, url, context):
+            to_fetch[stage].append((stage, url, context))
+    
+    if frontier.resuming:
+        for page in frontier.unfinished:
+            to_fetch[page[0]].append(page)
+    else:
+        for title_num, title_url in (TITLE_URLS if titles is None else titles).items():
+            enqueue("title", title_url, (title_num,))
+    fetched = deque()
+    fetching, parsing = {}, {}
+    last_report = time.monotonic()
+    
+    write_stage = WriterStage(writer, stats, buffer_size, frontier)
+    write_stage.start()
+    # Spawned parse processes don't inherit the fetch threads' locks
+    mp_context = multiprocessing.get_context("spawn")
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as fetch_pool, \
+                ProcessPoolExecutor(max_workers=parse_workers, mp_context=mp_context) as parse_pool:
+            while True:
+                while fetched and len(parsing) < parse_workers * 2:
+                    stage, url, context, content = fetched.popleft()
+                    future = parse_pool.submit(parse_stage, stage, content, url, context[0])
+                    parsing[future] = (stage, url, context)
+                
+                while len(fetching) < workers * 2 and len(fetching) + len(fetched) < buffer_size:
+                    pages = to_fetch["section"] or to_fetch["chapter"] or to_fetch["title"]
+                    if not pages:
+                        break
+                    stage, url, context = pages.popleft()
+                    fetching[fetch_pool.submit(fetch_stage, stage, url)] = (stage, url, context)
+                
+                stats.queued("fetch", sum(len(pages) for pages in to_fetch.values()))
+                stats.queued("parse", len(fetched))
+                if not fetching and not parsing:
+                    # This pass is done; retry what failed in a fresh one
+                    retry = frontier.retry_failed()
+                    if not retry:
+                        break
+                    print(f"🔁 Retrying {len(retry)} failed pages")
+                    for page in retry:
+                        to_fetch[page[0]].append(page)
+                    continue
+                
+                done, _ = wait(set(fetching) | set(parsing), return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in fetching:
+                        stage, url, context = fetching.pop(future)
+                        try:
+                            content, seconds = future.result()
+                        except Exception as e:
+                            print(f"❌ ERROR: fetch failed for {url}: {str(e)}")
+                            frontier.mark(url, "failed", str(e), attempt=True)
+                            continue
+                        stats.record("fetch", seconds, len(content or b""))
+                        if content is None:
+                            # Not modified, or not an HTML page: nothing to store
+                            frontier.mark(url, "stored", attempt=True)
+                        else:
+                            frontier.mark(url, "fetched", attempt=True)
+                            fetched.append((stage, url, context, content))
+                        continue
+                    
+                    stage, url, context = parsing.pop(future)
+                    try:
+                        result, seconds = future.result()
+                    except Exception as e:
+                        print(f"❌ ERROR: parse failed for {url}: {str(e)}")
+                        frontier.mark(url, "failed", str(e))
+                        continue
+                    stats.record("parse", seconds)
+                    
+                    if stage == "title":
+                        title_num, = context
+                        if not result:
+                            print(f"⚠️ No chapters found in Title {title_num} at {url}")
+                        else:
+                            print(f"Found {len(result)} chapters in Title {title_num}")
+                        for chapter_name, chapter_url in result:
+                            if in_shard(chapter_url, shard):
+                                enqueue("chapter", chapter_url, (title_num, chapter_name))
+                        frontier.mark(url, "stored")
+                    
+                    elif stage == "chapter":
+                        title_num, chapter_name = context
+                        if not result:
+                            print(f"⚠️ No sections found in {chapter_name} at {url}")
+                        else:
+                            print(f"Found {len(result)} sections in {chapter_name}")
+                        for section_id, section_url in result:
+                            enqueue("section", section_url, (title_num, chapter_name, section_id))
+                        frontier.mark(url, "stored")
+                    
+                    elif result:
+                        title_num, chapter_name, section_id = context
+                        frontier.mark(url, "parsed")
+                        write_stage.submit(title_num, chapter_name, section_id, url, result)
+                    
+                    else:
+                        frontier.mark(url, "stored")
                 
-                # Optionally save citation links too
-                for cite_text, cite_url in content['citation_links']:
-                    print(f"  🔗 Citation: {cite_text} -> {cite_url}")
+                frontier.maybe_flush()
+                if time.monotonic() - last_report >= PIPELINE_REPORT_INTERVAL:
+                    stats.report()
+                    last_report = time.monotonic()
+    finally:
+        try:
+            write_stage.close()
+        finally:
+            stats.report()
 
 if __name__ == "__main__":
-    print("Starting Washington State Law Crawler...")
-    scrape_laws()
-    print("\nCrawling completed.")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Crawl the Revised Code of Washington into Postgres.")
+    parser.add_argument("--workers", type=int, default=CRAWL_WORKERS, help="concurrent fetch workers (1 = sequential, which cannot be resumed)")
+    parser.add_argument("--incremental", action="store_true", help="conditional GETs; only write changed sections")
+    parser.add_argument("--parse-workers", type=int, default=PARSE_WORKERS,
+                        help="parse processes (0 = parse on the fetch threads, which cannot be resumed)")
+    parser.add_argument("--restart", action="store_true", help="discard an interrupted pipeline crawl instead of resuming it")
+    parser.add_argument("--archive", metavar="DIR", help="keep compressed raw responses in this page archive")
+    parser.add_argument("--replay", metavar="DIR", help="crawl from this page archive without the network")
+    parser.add_argument("--titles", metavar="SPEC", help='only these titles, e.g. "1-3,28A,40-45" (default: all)')
+    parser.add_argument("--shard", metavar="I/N", type=parse_shard, help="crawl chapter shard I of N (0-based)")
+    parser.add_argument("--metrics-file", metavar="PATH", help="write Prometheus metrics here during the crawl")
+    parser.add_argument("--rebuild-citations", action="store_true",
+                        help="re-extract the citation graph from stored sections instead of crawling")
+    args = parser.parse_args()
+    if args.titles:
+        # Fail on a malformed spec before touching the network
+        select_titles({}, args.titles)
+    
+    if args.rebuild_citations:
+        create_db()
+        rebuild_citation_graph()
+    else:
+        print("Starting Washington State Law Crawler...")
+        scrape_laws(workers=args.workers, incremental=args.incremental, parse_workers=args.parse_workers,
+                    restart=args.restart, archive=args.replay or args.archive, replay=bool(args.replay),
+                    titles=args.titles, shard=args.shard, metrics_file=args.metrics_file)
+        print("\nCrawling completed.")
\ No newline at end of file
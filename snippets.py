@@ -0,0 +1,79 @@
+import re
+
+from chunking import split_subsections
+
+# Longest snippet returned, in words, and the markers put around matched
+# words (the ts_headline defaults)
+SNIPPET_MAX_WORDS = 60
+HIGHLIGHT_START = "<b>"
+HIGHLIGHT_END = "</b>"
+ELLIPSIS = "…"
+
+# Question words that say nothing about which passage matters
+STOPWORDS = {
+    "a", "about", "an", "and", "are", "as", "at", "be", "between", "by", "can", "compare",
+    "difference", "differ", "do", "does", "for", "from", "how", "i", "in", "is", "it", "law",
+    "laws", "me", "my", "of", "on", "or", "rcw", "say", "says", "section", "tell", "that",
+    "the", "there", "this", "to", "under", "versus", "vs", "washington", "what", "when",
+    "where", "which", "who", "with",
+}
+
+# RCW numbers such as 2.04.010 or 28A.150, which are cited rather than searched for
+CITATION_PATTERN = re.compile(r"\b\d+[a-z]?(?:\.\d+[a-z]?)+\b", re.IGNORECASE)
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def stem(word):
+    """Crude suffix stripping so "judges" matches "judge" and "filed" matches "filing"."""
+    word = word.lower()
+    for suffix in ("ing", "es", "ed", "s"):
+        if len(word) > len(suffix) + 2 and word.endswith(suffix):
+            return word[:-len(suffix)]
+    return word
+
+
+def query_terms(question):
+    """Stemmed words of a question worth highlighting."""
+    words = WORD_PATTERN.findall(CITATION_PATTERN.sub(" ", question.lower()))
+    return {stem(word) for word in words if word not in STOPWORDS and len(word) > 1}
+
+
+def make_snippet(text, question, max_words=SNIPPET_MAX_WORDS):
+    """The passage of text that best matches question, with matched words highlighted.
+
+    Passages are the section's subsections; the one matching the most
+    distinct question terms wins (the first one when nothing matches) and
+    is cut to a max_words window around its first match.
+    """
+    if not text:
+        return text
+    terms = query_terms(question)
+    passages = split_subsections(text) or [text]
+    best = max(passages, key=lambda passage: len(terms & {stem(word) for word in WORD_PATTERN.findall(passage)}))
+
+    words = best.split()
+    first = next((i for i, word in enumerate(words) if token_term(word) in terms), 0)
+    start = max(0, min(first - max_words // 4, len(words) - max_words))
+    end = min(len(words), start + max_words)
+
+    snippet = " ".join(highlight(word, terms) for word in words[start:end])
+    if start > 0:
+        snippet = ELLIPSIS + snippet
+    if end < len(words):
+        snippet += ELLIPSIS
+    return snippet
+
+
+def token_term(token):
+    """Stem of the word inside a whitespace token such as "(judges)," (None for punctuation)."""
+    match = WORD_PATTERN.search(token)
+    return stem(match.group(0)) if match else None
+
+
+def highlight(word, terms):
+    """Wrap the word part of a whitespace token in highlight markers if it matches."""
+    if token_term(word) not in terms:
+        return word
+    match = WORD_PATTERN.search(word)
+    return f"{word[:match.start()]}{HIGHLIGHT_START}{match.group(0)}{HIGHLIGHT_END}{word[match.end():]}"
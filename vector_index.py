@@ -0,0 +1,159 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+# Default snapshot location; the index is stored as <path>.npy (vectors) and
+# <path>.ids.npy (chunk id, record id per row)
+VECTOR_INDEX_PATH = "vector_index"
+
+# Nearest chunks considered before grouping them back into sections
+CHUNK_CANDIDATES = 20
+
+
+class NumpyVectorIndex:
+    """Exact nearest-neighbour search over chunk embeddings held in NumPy.
+
+    Vectors live in one contiguous float32 matrix memory-mapped from a .npy
+    snapshot, so loading is instant and pages are shared between worker
+    processes. Embeddings are unit length, so dot products rank the same
+    way as pgvector's L2 distance.
+    """
+
+    def __init__(self, path=VECTOR_INDEX_PATH):
+        self.path = path
+        self.vectors = None
+        self.ids = np.empty((0, 2), dtype=np.int64)
+        self.loaded_mtime = None
+        self.pending_ids = []
+        self.pending_vectors = []
+        self.removed_records = set()
+        self.lock = threading.Lock()
+
+    @property
+    def vectors_file(self):
+        return f"{self.path}.npy"
+
+    @property
+    def ids_file(self):
+        return f"{self.path}.ids.npy"
+
+    def load(self):
+        """Memory-map the snapshot if it exists. Returns self."""
+        if not os.path.exists(self.vectors_file) or not os.path.exists(self.ids_file):
+            return self
+        mtime = os.path.getmtime(self.vectors_file)
+        vectors = np.load(self.vectors_file, mmap_mode="r")
+        ids = np.load(self.ids_file)
+        # A concurrent save may have replaced only one file; keep the old view
+        if len(vectors) != len(ids):
+            return self
+        with self.lock:
+            self.vectors, self.ids, self.loaded_mtime = vectors, ids, mtime
+        return self
+
+    def refresh(self):
+        """Reload the snapshot if update_embeddings has written a newer one."""
+        if os.path.exists(self.vectors_file) and os.path.getmtime(self.vectors_file) != self.loaded_mtime:
+            self.load()
+        return self
+
+    def __len__(self):
+        return 0 if self.vectors is None else len(self.vectors)
+
+    def search(self, query, k=1, candidates=CHUNK_CANDIDATES):
+        """Return up to k (record_id, score) pairs ranked by their best chunk."""
+        return self.search_many([query], k, candidates)[0]
+
+    def search_many(self, queries, k=1, candidates=CHUNK_CANDIDATES):
+        """search() for several queries at once, scoring them in one matrix multiply."""
+        with self.lock:
+            vectors, ids = self.vectors, self.ids
+        if vectors is None or not len(vectors) or not len(queries):
+            return [[] for _ in queries]
+        scores = np.asarray(queries, dtype=np.float32).reshape(len(queries), -1) @ vectors.T
+        n = min(max(candidates, k), scores.shape[1])
+        top = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+
+        results = []
+        for query_scores, query_top in zip(scores, top):
+            query_top = query_top[np.argsort(-query_scores[query_top])]
+            hits = []
+            seen = set()
+            for row in query_top:
+                record_id = int(ids[row, 1])
+                if record_id in seen:
+                    continue
+                seen.add(record_id)
+                hits.append((record_id, float(query_scores[row])))
+                if len(hits) == k:
+                    break
+            results.append(hits)
+        return results
+
+    def remove_records(self, record_ids):
+        """Drop all chunks of these sections on the next save (they were re-chunked)."""
+        self.removed_records.update(record_ids)
+
+    def add(self, chunk_ids, record_ids, vectors):
+        """Queue new or re-embedded chunks; they become visible after save()."""
+        self.pending_ids.extend(zip(chunk_ids, record_ids))
+        self.pending_vectors.extend(vectors)
+
+    def save(self):
+        """Merge queued changes into the snapshot and write it out."""
+        if not self.pending_ids and not self.removed_records:
+            return
+        self.refresh()
+        ids = self.ids
+        vectors = self.vectors if self.vectors is not None else np.empty((0, 0), dtype=np.float32)
+
+        new_ids = np.array(self.pending_ids, dtype=np.int64).reshape(-1, 2)
+        keep = ~np.isin(ids[:, 1], list(self.removed_records)) & ~np.isin(ids[:, 0], new_ids[:, 0])
+        if self.pending_vectors:
+            new_vectors = np.asarray(self.pending_vectors, dtype=np.float32)
+            merged_vectors = np.concatenate([vectors[keep], new_vectors]) if len(ids) else new_vectors
+        else:
+            merged_vectors = np.asarray(vectors[keep])
+        merged_ids = np.concatenate([ids[keep], new_ids])
+
+        write_snapshot(self.path, merged_ids, merged_vectors)
+        self.pending_ids, self.pending_vectors, self.removed_records = [], [], set()
+        self.load()
+
+
+def write_snapshot(path, ids, vectors):
+    """Write ids then vectors, each via a temp file and an atomic rename."""
+    for suffix, array in ((".ids.npy", ids), (".npy", np.ascontiguousarray(vectors, dtype=np.float32))):
+        tmp_file = f"{path}.tmp{suffix}"
+        np.save(tmp_file, array)
+        os.replace(tmp_file, f"{path}{suffix}")
+
+
+def build_snapshot(conn, path=VECTOR_INDEX_PATH, fetch_size=5000):
+    """Rebuild the snapshot from every embedded chunk in the database."""
+    cursor = conn.cursor(name="vector_snapshot")
+    cursor.itersize = fetch_size
+    cursor.execute("SELECT id, record_id, embedding::text FROM legal_chunks WHERE embedding IS NOT NULL ORDER BY id")
+    ids, vectors = [], []
+    for chunk_id, record_id, embedding in cursor:
+        ids.append((chunk_id, record_id))
+        vectors.append(np.array(json.loads(embedding), dtype=np.float32))
+    cursor.close()
+    conn.commit()
+
+    write_snapshot(path, np.array(ids, dtype=np.int64).reshape(-1, 2), np.array(vectors, dtype=np.float32))
+    print(f"✅ Wrote vector index snapshot with {len(ids)} chunks to {path}.npy")
+    return NumpyVectorIndex(path).load()
+
+
+if __name__ == "__main__":
+    import psycopg2
+    from embeddings import DB_CONFIG
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        build_snapshot(conn)
+    finally:
+        conn.close()